@@ -1,58 +1,320 @@
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Comment, Tag
+from ColdStorage import ColdStorage, tree_usage
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from EventStore import EventStore
+from Journal import Journal
+from HTMLRenderer import HISTORY_END_COMMENT, HISTORY_END_MARKER, NEXT_LINK, chat_entry_tag, render_message, write_message, write_page
+from Metrics import metrics
 from pathlib import Path
+from typing import Any, BinaryIO, Optional
+import json
+import os
 import re
+import tempfile
+import threading
+import time
+
+# Сколько байт с конца файла просматривать в поисках маркера.
+TAIL_SCAN_BYTES = 64 * 1024
+# Снимок индекса chats.html в корне архива и версия его формата.
+INDEX_SNAPSHOT_NAME = "chats_index.json"
+INDEX_SNAPSHOT_VERSION = 1
+
+
+def page_file_name(page: int) -> str:
+    """Возвращает имя файла страницы чата, как в экспорте Telegram: messages.html, messages2.html, ..."""
+    return "messages.html" if page == 1 else f"messages{page}.html"
+
+
+def page_number(messages_html: Path) -> int:
+    """Возвращает номер страницы чата по имени файла."""
+    match = re.fullmatch(r"messages(\d*)\.html", messages_html.name)
+    if not match:
+        raise ValueError(f"Не страница чата: {messages_html.name}")
+    return int(match.group(1) or 1)
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    """Записывает файл через временный файл и rename, чтобы не оставить его обрезанным."""
+    data = text.encode("utf-8")
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with metrics.time("disk_write"), os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+    metrics.inc("bytes_written_total", len(data), mode="rewrite")
+
+
+@dataclass
+class ChatEntry:
+    """Запись чата из chats.html, закэшированная в индексе.
+
+    У записей, загруженных из снимка индекса, tag и count_tag пусты, пока
+    chats.html не понадобится разобрать для изменения.
+    """
+    name: str
+    folder: Path
+    count: int
+    tag: Optional[Tag] = None
+    count_tag: Optional[Tag] = None
+    peer_id: Optional[int] = None
+    last_message_id: Optional[int] = None
+
 
 class ChatHTMLManager:
-    """Класс для работы с файлом chats.html."""
+    """Класс для работы с файлом chats.html.
 
-    def __init__(self, html_path: Path):
+    Индекс чатов сохраняется в снимок chats_index.json рядом с archive.sqlite
+    после каждой записи chats.html. При запуске снимок используется, если
+    mtime и размер chats.html совпадают с записанными в нем, и сам
+    chats.html разбирается только при первом изменении.
+    """
+
+    def __init__(self, html_path: Path, flush_interval: float = 0.0, flush_every: int = 1, page_size: int = 1000):
+        """Инициализация менеджера.
+
+        Args:
+            html_path (Path): Путь к chats.html.
+            flush_interval (float): Не реже чем раз в столько секунд
+                измененный chats.html сбрасывается на диск.
+            flush_every (int): Сбрасывать chats.html после стольких изменений.
+            page_size (int): Максимальное число сообщений на одной странице чата.
+        """
         self.html_path = html_path
-        self.soup = self._load_html()
+        self.page_size = page_size
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+        self._pending_changes = 0
+        self._last_flush = time.monotonic()
+        # Отрисовка и запись chats.html могут вызываться из разных потоков.
+        self._lock = threading.RLock()
+        self.snapshot_path = html_path.parent.parent / INDEX_SNAPSHOT_NAME
+        self._soup: Optional[BeautifulSoup] = None
+        # Индекс записей chats.html: peer id -> запись и имя -> запись.
+        self._entries_by_peer: dict[int, ChatEntry] = {}
+        self._entries_by_name: dict[str, ChatEntry] = {}
+        if not self._load_snapshot():
+            self._build_index()
+            self._save_snapshot()
+        # Смещения маркера конца истории для каждого messages.html.
+        self._tail_offsets: dict[str, int] = {}
+        # Журнал, в который перед изменением страниц пишется, как их откатить.
+        self.journal: Optional[Journal] = None
+        self.flushed_seq = 0
+        self._page_ops: list[dict] = []
+        # Сжатые неактивные чаты; восстанавливаются при первом обращении к их страницам.
+        self.cold = ColdStorage(html_path.parent.parent)
+
+    @property
+    def soup(self) -> BeautifulSoup:
+        """Разобранный chats.html; при первом обращении загружается и связывается с индексом."""
+        return self._ensure_soup()
+
+    def _ensure_soup(self) -> BeautifulSoup:
+        """Разбирает chats.html, если он еще не разобран, и привязывает теги к записям индекса."""
+        with self._lock:
+            if self._soup is None:
+                self._soup = self._load_html()
+                if self._entries_by_name or self._entries_by_peer:
+                    self._bind_tags()
+            return self._soup
 
     def _load_html(self) -> BeautifulSoup:
         """Загружает HTML-содержимое."""
         if not self.html_path.exists():
             raise FileNotFoundError(f"Файл не найден: {self.html_path}")
-        with self.html_path.open(encoding="utf-8") as f:
+        with metrics.time("html_parse"), self.html_path.open(encoding="utf-8") as f:
             return BeautifulSoup(f, "html.parser")
 
+    def configure_flush(self, flush_interval: float, flush_every: int) -> None:
+        """Включает отложенную запись chats.html.
+
+        Args:
+            flush_interval (float): Максимальная задержка записи в секундах.
+            flush_every (int): Максимальное число несохраненных изменений.
+        """
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+
     def _save_html(self) -> None:
-        """Сохраняет изменения в файл."""
-        with self.html_path.open("w", encoding="utf-8") as f:
-            f.write(str(self.soup))
+        """Помечает документ измененным и сбрасывает его на диск, если пора."""
+        self._pending_changes += 1
+        if self._pending_changes >= self.flush_every:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self) -> None:
+        """Сбрасывает chats.html, если с последней записи прошло flush_interval."""
+        with self._lock:
+            if self._pending_changes and time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self) -> None:
+        """Атомарно записывает накопленные изменения chats.html."""
+        with self._lock:
+            if not self._pending_changes:
+                return
+            atomic_write_text(self.html_path, str(self.soup))
+            self._pending_changes = 0
+            self._last_flush = time.monotonic()
+            self._save_snapshot()
+            if self.journal is not None:
+                self.flushed_seq = self.journal.last_seq
+
+    def _entries(self) -> list[ChatEntry]:
+        """Возвращает все записи индекса без повторов."""
+        unique = {id(entry): entry for entry in self._entries_by_name.values()}
+        unique.update((id(entry), entry) for entry in self._entries_by_peer.values())
+        return list(unique.values())
+
+    def _html_stat(self) -> dict[str, int]:
+        """Возвращает mtime и размер chats.html, по которым проверяется снимок."""
+        stat = self.html_path.stat()
+        return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+    def _load_snapshot(self) -> bool:
+        """Загружает индекс из снимка, если он соответствует текущему chats.html.
+
+        Returns:
+            bool: False, если снимка нет, он устарел или поврежден.
+        """
+        if not self.html_path.exists():
+            raise FileNotFoundError(f"Файл не найден: {self.html_path}")
+        try:
+            snapshot = json.loads(self.snapshot_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return False
+        if snapshot.get("version") != INDEX_SNAPSHOT_VERSION or snapshot.get("html") != self._html_stat():
+            return False
+
+        chats_dir = self.html_path.parent.parent / "chats"
+        for item in snapshot["entries"]:
+            entry = ChatEntry(
+                name=item["name"],
+                folder=chats_dir / item["folder"],
+                count=item["count"],
+                peer_id=item["peer_id"],
+                last_message_id=item["last_message_id"],
+            )
+            if entry.peer_id is not None:
+                self._entries_by_peer[entry.peer_id] = entry
+            self._entries_by_name.setdefault(entry.name, entry)
+        return True
+
+    def _save_snapshot(self) -> None:
+        """Записывает снимок индекса для только что записанного chats.html."""
+        snapshot = {
+            "version": INDEX_SNAPSHOT_VERSION,
+            "html": self._html_stat(),
+            "entries": [
+                {"name": entry.name, "folder": entry.folder.name, "count": entry.count,
+                 "peer_id": entry.peer_id, "last_message_id": entry.last_message_id}
+                for entry in self._entries()
+            ],
+        }
+        atomic_write_text(self.snapshot_path, json.dumps(snapshot, ensure_ascii=False))
 
-    def user_exists(self, name: str) -> bool:
-        """Проверяет, есть ли пользователь по имени."""
-        entries = self.soup.select(".entry .name.bold")
-        return any(name.strip() in entry.get_text(strip=True) for entry in entries)
+    def _bind_tags(self) -> None:
+        """Связывает записи, загруженные из снимка, с тегами разобранного chats.html."""
+        by_folder = {entry.folder.name: entry for entry in self._entries()}
+        for a_tag in self._soup.select("a.entry"):
+            parsed = self._parse_entry(a_tag)
+            entry = by_folder.get(parsed.folder.name) if parsed else None
+            if entry is not None:
+                entry.tag, entry.count_tag = parsed.tag, parsed.count_tag
 
-    def add_user(self, name: str, initial: str, href: str, messages_count: int, chat_type: str = "private") -> None:
+    def _build_index(self) -> None:
+        """Строит индекс записей chats.html по peer id и по имени."""
+        self._entries_by_peer = {}
+        self._entries_by_name = {}
+        for a_tag in self.soup.select("a.entry"):
+            entry = self._parse_entry(a_tag)
+            if entry is None:
+                continue
+            if entry.peer_id is not None:
+                self._entries_by_peer[entry.peer_id] = entry
+            self._entries_by_name.setdefault(entry.name, entry)
+
+    def _parse_entry(self, a_tag: Tag) -> Optional[ChatEntry]:
+        """Извлекает данные записи чата из тега <a class="entry">."""
+        name_tag = a_tag.select_one(".name.bold")
+        if not name_tag or not a_tag.get("href"):
+            return None
+
+        count_tag = name_tag.find_next_sibling("div", class_="details_entry details")
+        count = 0
+        if count_tag:
+            match = re.search(r"(\d+) messages", count_tag.get_text(strip=True))
+            if match:
+                count = int(match.group(1))
+
+        peer_id = a_tag.get("data-peer-id")
+        chat_dir = a_tag["href"].split('/')[2]  # e.g., "chat_001"
+        return ChatEntry(
+            name=name_tag.get_text(strip=True),
+            folder=self.html_path.parent.parent / "chats" / chat_dir,
+            count=count,
+            tag=a_tag,
+            count_tag=count_tag,
+            peer_id=int(peer_id) if peer_id else None,
+        )
+
+    def _find_entry(self, name: str, peer_id: Optional[int] = None) -> Optional[ChatEntry]:
+        """Ищет запись чата по peer id, а для старых записей — по точному имени.
+
+        Старая запись без peer id при первом совпадении по имени привязывается
+        к переданному peer id.
+        """
+        if peer_id is not None and peer_id in self._entries_by_peer:
+            return self._entries_by_peer[peer_id]
+
+        entry = self._entries_by_name.get(name.strip())
+        if entry is None or peer_id is None:
+            return entry
+        if entry.peer_id is not None:
+            # Тот же display name, но другой пользователь.
+            return None
+
+        self._ensure_soup()
+        entry.peer_id = peer_id
+        entry.tag["data-peer-id"] = str(peer_id)
+        self._entries_by_peer[peer_id] = entry
+        self._save_html()
+        return entry
+
+    def _get_entry(self, name: str, peer_id: Optional[int] = None) -> ChatEntry:
+        """Как _find_entry, но выбрасывает ValueError, если запись не найдена."""
+        entry = self._find_entry(name, peer_id)
+        if entry is None:
+            raise ValueError(f"Пользователь {name} не найден в chats.html")
+        return entry
+
+    def user_exists(self, name: str, peer_id: Optional[int] = None) -> bool:
+        """Проверяет, есть ли пользователь по peer id или имени."""
+        return self._find_entry(name, peer_id) is not None
+
+    def add_user(self, name: str, initial: str, href: str, messages_count: int, chat_type: str = "private", peer_id: Optional[int] = None) -> None:
         """Добавляет нового пользователя в HTML."""
-        if self.user_exists(name):
+        if self.user_exists(name, peer_id):
             return
 
         entry_list = self.soup.select_one(".entry_list")
         if not entry_list:
             raise ValueError("Не найдена точка вставки (.entry_list) в HTML.")
 
-        new_entry = BeautifulSoup(f"""
-        <a class="entry block_link clearfix" href="{href}">
-          <div class="pull_left userpic_wrap">
-           <div class="userpic userpic7" style="width: 48px; height: 48px">
-            <div class="initials" style="line-height: 48px">
-              {initial}
-            </div>
-           </div>
-          </div>
-          <div class="body">
-           <div class="pull_right info details">{chat_type}</div>
-           <div class="name bold">{name}</div>
-           <div class="details_entry details">{messages_count} messages</div>
-          </div>
-        </a>
-        """, "html.parser")
-
+        new_entry = chat_entry_tag(name, initial, href, messages_count, chat_type, peer_id)
         entry_list.append(new_entry)
+        entry = self._parse_entry(new_entry)
+        if entry.peer_id is not None:
+            self._entries_by_peer[entry.peer_id] = entry
+        self._entries_by_name.setdefault(entry.name, entry)
         self._save_html()
 
     def get_next_chat_folder(self) -> Path:
@@ -66,152 +328,533 @@ class ChatHTMLManager:
         chat_folder.mkdir()
         return chat_folder
 
-    def get_chat_folder_for_existing_user(self, name: str) -> Path:
-        """Находит папку чата для существующего пользователя."""
-        entries = self.soup.select(".entry .name.bold")
-        for entry in entries:
-            if name.strip() in entry.get_text(strip=True):
-                a_tag = entry.find_parent("a")
-                if a_tag:
-                    href = a_tag['href']
-                    chat_dir = href.split('/')[2]  # e.g., "chat_001"
-                    base_dir = self.html_path.parent.parent
-                    return base_dir / "chats" / chat_dir
-        raise ValueError(f"Пользователь {name} не найден в chats.html")
-
-    def get_message_count(self, name: str) -> int:
+    def get_chat_folder_for_existing_user(self, name: str, peer_id: Optional[int] = None) -> Path:
+        """Находит папку чата для существующего пользователя; сжатая папка восстанавливается."""
+        return self._ensure_hot(self._get_entry(name, peer_id).folder)
+
+    def _ensure_hot(self, chat_folder: Path) -> Path:
+        """Восстанавливает сжатую папку чата перед изменением ее страниц."""
+        if self.cold.is_cold(chat_folder.name):
+            self.cold.rehydrate(chat_folder)
+            self._forget_offsets(chat_folder)
+            metrics.inc("cold_rehydrations_total")
+        return chat_folder
+
+    def _forget_offsets(self, chat_folder: Path) -> None:
+        """Сбрасывает сохраненные смещения маркера для страниц папки."""
+        prefix = str(chat_folder / "messages")
+        for key in [key for key in self._tail_offsets if key.startswith(prefix)]:
+            del self._tail_offsets[key]
+
+    def compact_cold_chats(self, store: EventStore, idle_days: float, dry_run: bool = False) -> list[dict[str, Any]]:
+        """Сжимает папки чатов без активности дольше idle_days дней (см. ColdStorage).
+
+        Последняя активность — дата последнего сообщения чата в store, а для
+        чатов, которых нет в store (из исходного экспорта), — время изменения
+        самой новой страницы.
+
+        Args:
+            store (EventStore): Хранилище с датами сообщений.
+            idle_days (float): Сколько дней без активности считать чат неактивным.
+            dry_run (bool): Только найти чаты, ничего не сжимая.
+
+        Returns:
+            list[dict[str, Any]]: Сжатые (или найденные) чаты с местом на диске до и после.
+        """
+        cutoff = datetime.now(timezone.utc).timestamp() - idle_days * 86400
+        activity = store.chat_activity()
+        compacted = []
+        with self._lock:
+            for entry in self._entries():
+                folder = entry.folder
+                if not folder.is_dir() or self.cold.is_cold(folder.name):
+                    continue
+                pages = list(folder.glob("messages*.html"))
+                if not pages:
+                    continue
+                if folder.name in activity:
+                    last_active = datetime.fromisoformat(activity[folder.name]).timestamp()
+                else:
+                    last_active = max(page.stat().st_mtime for page in pages)
+                if last_active >= cutoff:
+                    continue
+                last_activity = datetime.fromtimestamp(last_active, timezone.utc).isoformat(timespec="seconds")
+                if dry_run:
+                    files, original = tree_usage(folder)
+                    result = {"name": entry.name, "last_activity": last_activity, "files": files,
+                              "original_bytes": original, "compressed_bytes": None}
+                else:
+                    result = self.cold.compact(folder, entry.name, last_activity)
+                    self._forget_offsets(folder)
+                    metrics.inc("cold_compactions_total")
+                compacted.append({"folder": folder.name, **result})
+        return compacted
+
+    def get_message_count(self, name: str, peer_id: Optional[int] = None) -> int:
         """Получает текущее количество сообщений для пользователя."""
-        entries = self.soup.select(".entry .name.bold")
-        for entry in entries:
-            if name.strip() in entry.get_text(strip=True):
-                details_entry = entry.find_next_sibling("div", class_="details_entry details")
-                if details_entry:
-                    text = details_entry.get_text(strip=True)
-                    match = re.search(r"(\d+) messages", text)
-                    if match:
-                        return int(match.group(1))
-        raise ValueError(f"Пользователь {name} не найден в chats.html")
-
-    def update_message_count(self, name: str, new_count: int) -> None:
+        return self._get_entry(name, peer_id).count
+
+    def update_message_count(self, name: str, new_count: int, peer_id: Optional[int] = None) -> None:
         """Обновляет количество сообщений для пользователя."""
-        entries = self.soup.select(".entry .name.bold")
-        for entry in entries:
-            if name.strip() in entry.get_text(strip=True):
-                details_entry = entry.find_next_sibling("div", class_="details_entry details")
-                if details_entry:
-                    details_entry.string = f"{new_count} messages"
-                    self._save_html()
-                    return
-        raise ValueError(f"Пользователь {name} не найден в chats.html")
-
-    def create_chat_messages_html(self, folder: Path, name: str, initial: str, messages: list) -> None:
-        """Создает новый файл messages.html с начальными сообщениями."""
-        html_content = f"""<!DOCTYPE html>
-<html>
- <head>
-  <meta charset="utf-8"/>
-  <title>Exported Data</title>
-  <meta content="width=device-width, initial-scale=1.0" name="viewport"/>
-  <link href="../../css/style.css" rel="stylesheet"/>
-  <script src="../../js/script.js" type="text/javascript"></script>
- </head>
- <body onload="CheckLocation();">
-  <div class="page_wrap">
-   <div class="page_header">
-    <a class="content block_link" href="../../lists/chats.html" onclick="return GoBack(this)">
-     <div class="text bold">{name}</div>
-    </a>
-   </div>
-   <div class="page_body chat_page">
-    <div class="history">
-"""
-        for msg in messages:
-            message_html = f"""
-     <div class="message default clearfix" id="message{msg['id']}">
-      <div class="pull_left userpic_wrap">
-       <div class="userpic userpic7" style="width: 42px; height: 42px">
-        <div class="initials" style="line-height: 42px">{initial}</div>
-       </div>
-      </div>
-      <div class="body">
-       <div class="pull_right date details" title="{msg['timestamp']}">
-        {msg['time']}
-       </div>
-       <div class="from_name">{msg['sender_name']}</div>
-       <div class="text">{msg['text']}</div>
-      </div>
-     </div>
-            """
-            html_content += message_html
-
-        html_content += """
-    </div>
-   </div>
-  </div>
- </body>
-</html>
-"""
-        (folder / "messages.html").write_text(html_content, encoding="utf-8")
-
-    def append_message_to_chat(self, chat_folder: Path, message_data: dict) -> None:
-        """Добавляет новое сообщение в существующий messages.html."""
-        messages_html = chat_folder / "messages.html"
+        entry = self._get_entry(name, peer_id)
+        self._ensure_soup()
+        if entry.count_tag is None:
+            raise ValueError(f"Счетчик сообщений для {name} не найден в chats.html")
+        entry.count = new_count
+        entry.count_tag.string = f"{new_count} messages"
+        self._save_html()
+
+    def create_chat_messages_html(self, folder: Path, name: str, initial: str, messages: list, page: int = 1) -> None:
+        """Создает новую страницу чата (messages.html, messages2.html, ...) с начальными сообщениями.
+
+        Args:
+            folder (Path): Папка чата.
+            name (str): Имя чата для заголовка страницы.
+            initial (str): Инициал для аватара.
+            messages (list): Сообщения страницы.
+            page (int): Номер страницы; со второй страницы добавляется ссылка на предыдущую.
+        """
+        messages_html = folder / page_file_name(page)
+        self._journal_page_op({"kind": "page_create", "path": self._archive_path(messages_html)})
+        with metrics.time("disk_write"), messages_html.open("w", encoding="utf-8") as f:
+            write_page(f.write, name, initial, messages, page_file_name(page - 1) if page > 1 else None)
+        metrics.inc("bytes_written_total", messages_html.stat().st_size, mode="create")
+
+    @staticmethod
+    def _message_from_div(message_div: Tag) -> dict:
+        """Восстанавливает данные сообщения из старой разметки (для сообщений, которых нет в базе)."""
+        def text_of(class_: str) -> str:
+            tag = message_div.find("div", class_=class_)
+            return tag.get_text(strip=True) if tag else ""
+
+        date_div = message_div.find("div", class_="date")
+        text_div = message_div.find("div", class_="text")
+        return {
+            "id": int(message_div["id"].removeprefix("message")),
+            "initial": text_of("initials"),
+            "timestamp": date_div.get("title", "") if date_div else "",
+            "time": text_of("date"),
+            "sender_name": text_of("from_name"),
+            "text": text_of("text"),
+            "text_html": text_div.decode_contents().strip() if text_div else "",
+        }
+
+    def append_message_to_chat(self, chat_folder: Path, message_data: dict, page: int = 1) -> None:
+        """Добавляет новое сообщение в существующую страницу чата."""
+        self.append_messages_to_chat(chat_folder, [message_data], page)
+
+    def append_messages_to_chat(self, chat_folder: Path, messages: list, page: int = 1) -> None:
+        """Добавляет пачку сообщений в существующую страницу чата одной записью.
+
+        Фрагмент дописывается перед маркером конца истории без разбора всего
+        файла. Полный разбор через BeautifulSoup выполняется только если
+        маркер не найден (старый или поврежденный файл).
+        """
+        messages_html = chat_folder / page_file_name(page)
         if not messages_html.exists():
-            raise FileNotFoundError(f"messages.html не найден в {chat_folder}")
+            raise FileNotFoundError(f"{messages_html.name} не найден в {chat_folder}")
+
+        out: list[str] = []
+        for msg in messages:
+            write_message(out.append, msg)
+        fragment = "".join(out)
+        self._append_fragment(messages_html, fragment)
+
+    def _append_fragment(self, messages_html: Path, fragment: str) -> None:
+        """Дописывает HTML-фрагмент в конец истории страницы."""
+        if not self._append_before_marker(messages_html, fragment):
+            self._restore_marker(messages_html)
+            if not self._append_before_marker(messages_html, fragment):
+                raise ValueError(f"Маркер конца истории не найден в {messages_html.name}")
+
+    def write_messages_paged(self, chat_folder: Path, name: str, initial: str, count: int, messages: list) -> list[int]:
+        """Раскладывает новые сообщения по страницам чата по page_size сообщений.
+
+        Затрагивается только текущая последняя страница; при ее заполнении
+        создается следующая, а в предыдущую дописывается ссылка на нее.
+
+        Args:
+            chat_folder (Path): Папка чата.
+            name (str): Имя чата.
+            initial (str): Инициал для аватара.
+            count (int): Число сообщений в чате до добавления.
+            messages (list): Новые сообщения в порядке поступления.
+
+        Returns:
+            list[int]: Номера страниц, на которые попали сообщения, в том же порядке.
+        """
+        pages = []
+        while messages:
+            page = count // self.page_size + 1
+            room = page * self.page_size - count
+            chunk, messages = messages[:room], messages[room:]
+            if (chat_folder / page_file_name(page)).exists():
+                self.append_messages_to_chat(chat_folder, chunk, page)
+            else:
+                self.create_chat_messages_html(chat_folder, name, initial, chunk, page)
+                if page > 1 and (chat_folder / page_file_name(page - 1)).exists():
+                    self._append_fragment(chat_folder / page_file_name(page - 1), NEXT_LINK.render(href=page_file_name(page)))
+            count += len(chunk)
+            pages.extend([page] * len(chunk))
+        return pages
+
+    def _find_message_page(self, chat_folder: Path, message_id: int, page: Optional[int] = None) -> Path:
+        """Находит страницу чата с сообщением.
 
-        with messages_html.open(encoding="utf-8") as f:
+        Если страница известна из индекса, она возвращается сразу; иначе
+        страницы просматриваются с последней, и разбирается только та, в
+        тексте которой найден id.
+        """
+        if page is not None and (chat_folder / page_file_name(page)).exists():
+            return chat_folder / page_file_name(page)
+
+        message_attr = f'id="message{message_id}"'
+        for messages_html in sorted(chat_folder.glob("messages*.html"), key=page_number, reverse=True):
+            if message_attr in messages_html.read_text(encoding="utf-8"):
+                return messages_html
+        raise ValueError(f"Сообщение с id {message_id} не найдено")
+
+    def _find_marker_offset(self, messages_html: Path, f: BinaryIO, size: int) -> Optional[int]:
+        """Ищет смещение маркера конца истории, начиная с сохраненного."""
+        marker = HISTORY_END_MARKER.encode("utf-8")
+        cached = self._tail_offsets.get(str(messages_html))
+        if cached is not None and cached < size:
+            f.seek(cached)
+            if f.read(len(marker)) == marker:
+                return cached
+
+        tail_start = max(0, size - TAIL_SCAN_BYTES)
+        f.seek(tail_start)
+        index = f.read().rfind(marker)
+        if index == -1:
+            return None
+        return tail_start + index
+
+    def _append_before_marker(self, messages_html: Path, fragment: str) -> bool:
+        """Дописывает фрагмент перед маркером, сохраняя хвост файла.
+
+        Returns:
+            bool: False, если маркер не найден и нужен полный разбор.
+        """
+        with open(messages_html, "r+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            offset = self._find_marker_offset(messages_html, f, size)
+            if offset is None:
+                self._tail_offsets.pop(str(messages_html), None)
+                return False
+
+            f.seek(offset)
+            footer = f.read()
+            data = fragment.encode("utf-8")
+            self._journal_page_op({"kind": "page_append", "path": self._archive_path(messages_html),
+                                   "offset": offset, "footer": footer.decode("utf-8")})
+            f.seek(offset)
+            with metrics.time("disk_write"):
+                f.write(data + footer)
+                f.truncate()
+        metrics.inc("bytes_written_total", len(data) + len(footer), mode="append")
+        self._tail_offsets[str(messages_html)] = offset + len(data)
+        return True
+
+    def _restore_marker(self, messages_html: Path) -> None:
+        """Ставит маркер конца истории в старую или поврежденную страницу через полный разбор.
+
+        Страница перезаписывается атомарно и без новых сообщений, поэтому
+        откатывать эту запись после сбоя не нужно.
+        """
+        metrics.inc("full_parse_fallbacks_total")
+        with metrics.time("html_parse"), messages_html.open(encoding="utf-8") as f:
             soup = BeautifulSoup(f, "html.parser")
 
         history_div = soup.find("div", class_="history")
         if not history_div:
             raise ValueError("History div не найден в messages.html")
 
-        new_message = BeautifulSoup(f"""
-     <div class="message default clearfix" id="message{message_data['id']}">
-      <div class="pull_left userpic_wrap">
-       <div class="userpic userpic7" style="width: 42px; height: 42px">
-        <div class="initials" style="line-height: 42px">{message_data['initial']}</div>
-       </div>
-      </div>
-      <div class="body">
-       <div class="pull_right date details" title="{message_data['timestamp']}">
-        {message_data['time']}
-       </div>
-       <div class="from_name">{message_data['sender_name']}</div>
-       <div class="text">{message_data['text']}</div>
-      </div>
-     </div>
-        """, "html.parser")
-
-        history_div.append(new_message)
-        with messages_html.open("w", encoding="utf-8") as f:
-            f.write(str(soup))
-
-    def update_message_in_chat(self, chat_folder: Path, message_id: int, new_text: str, edit_time: str) -> None:
-        """Обновляет сообщение в messages.html при редактировании."""
-        messages_html = chat_folder / "messages.html"
-        if not messages_html.exists():
-            raise FileNotFoundError(f"messages.html не найден в {chat_folder}")
+        for comment in history_div.find_all(string=lambda s: isinstance(s, Comment) and s == HISTORY_END_COMMENT):
+            comment.extract()
+        history_div.append(Comment(HISTORY_END_COMMENT))
+        history_div.append("\n    ")
 
-        with messages_html.open(encoding="utf-8") as f:
-            soup = BeautifulSoup(f, "html.parser")
+        atomic_write_text(messages_html, str(soup))
+        self._tail_offsets.pop(str(messages_html), None)
 
-        message_div = soup.find("div", id=f"message{message_id}")
-        if not message_div:
-            raise ValueError(f"Сообщение с id {message_id} не найдено")
+    def rerender_messages(self, messages_html: Path, messages: dict[tuple[int, int], Optional[dict]],
+                          extras: dict[tuple[int, int], dict]) -> None:
+        """Перерисовывает сообщения на странице с учетом правок, вложений и удалений.
 
-        text_div = message_div.find("div", class_="text")
-        if not text_div:
-            raise ValueError("div.text не найден в сообщении")
+        Блок сообщения, обрамленный маркерами <!--m{id}-->, заменяется срезом
+        строки без разбора страницы. Полный разбор выполняется только для
+        сообщений без маркеров (старая разметка).
+
+        Сообщения задаются парой (id, номер вхождения): у одного отправителя на
+        странице может быть несколько сообщений с одним id из разных
+        супергрупп, и их блоки различаются по порядку на странице.
+
+        Args:
+            messages_html (Path): Страница чата.
+            messages (dict[tuple[int, int], Optional[dict]]): (id, вхождение) -> данные
+                сообщения из базы или None, если сообщения в базе нет.
+            extras (dict[tuple[int, int], dict]): (id, вхождение) -> {"versions": правки по порядку, "media": вложения}.
+        """
+        html = messages_html.read_text(encoding="utf-8")
+        unmarked = {}
+        for key, message_data in messages.items():
+            message_id, occurrence = key
+            start_marker, end_marker = f"<!--m{message_id}-->", f"<!--/m{message_id}-->"
+            start = -1
+            for _ in range(occurrence + 1):
+                start = html.find(start_marker, start + 1)
+                if start == -1:
+                    break
+            end = html.find(end_marker, start)
+            if message_data is None or start == -1 or end == -1:
+                unmarked[key] = message_data
+                continue
+            block = render_message({**message_data, **extras.get(key, {})}).strip()
+            html = html[:start] + block + html[end + len(end_marker):]
+
+        if unmarked:
+            metrics.inc("full_parse_fallbacks_total")
+            with metrics.time("html_parse"):
+                soup = BeautifulSoup(html, "html.parser")
+            for key, message_data in unmarked.items():
+                message_id, occurrence = key
+                message_divs = soup.find_all("div", id=f"message{message_id}")
+                if len(message_divs) <= occurrence:
+                    raise ValueError(f"Сообщение с id {message_id} не найдено")
+                message_div = message_divs[occurrence]
+                if message_data is None:
+                    message_data = self._message_from_div(message_div)
+                block = render_message({**message_data, **extras.get(key, {})})
+                message_div.replace_with(BeautifulSoup(block, "html.parser"))
+            html = str(soup)
+
+        atomic_write_text(messages_html, html)
+        self._tail_offsets.pop(str(messages_html), None)
+
+    def _rerender_from_store(self, store: EventStore, chat_folder: Path, pages: dict[int, list[tuple[int, int]]]) -> None:
+        """Перерисовывает сообщения, сгруппированные по страницам, по данным store.
+
+        Args:
+            store (EventStore): Хранилище событий.
+            chat_folder (Path): Папка чата.
+            pages (dict[int, list[tuple[int, int]]]): Номер страницы -> пары (chat_id, id сообщения).
+        """
+        for page, refs in pages.items():
+            messages, extras = {}, {}
+            for chat_id, message_id in refs:
+                message_data = store.get_message(chat_id, message_id)
+                key = (message_id, store.page_occurrence(message_data["rowid"]) if message_data else 0)
+                messages[key] = message_data
+                extras[key] = {"versions": store.get_versions(chat_id, message_id), "media": store.get_media(chat_id, message_id)}
+            self.rerender_messages(chat_folder / page_file_name(page), messages, extras)
+
+    def _find_page_number(self, chat_folder: Path, message_id: int) -> int:
+        """Возвращает номер страницы, на которой лежит сообщение."""
+        return page_number(self._find_message_page(chat_folder, message_id))
+
+    def render_pending(self, store: EventStore) -> None:
+        """Отрисовывает в HTML сообщения, правки и удаления, записанные в store после прошлой отрисовки.
+
+        Затрагиваются только чаты с новыми событиями; новые сообщения чата
+        дописываются одной записью. Дописанные сообщения коммитятся до
+        перезаписи страниц правками и удалениями: после сбоя незакоммиченное
+        дописывание всегда последнее изменение страницы и откатывается по
+        смещению из журнала.
+        """
+        with self._lock:
+            rendered = []
+            for peer_id in store.dirty_peers():
+                user = store.get_user(peer_id)
+                if user is None:
+                    continue
+                try:
+                    messages = store.unrendered_messages(peer_id)
+                    if messages:
+                        with metrics.time("render_messages"):
+                            chat_folder, pages = self._render_new_messages(peer_id, user["display_name"], user["initial"], messages)
+                        rowids = [msg["rowid"] for msg in messages]
+                        store.mark_messages_rendered(chat_folder.name, list(zip(rowids, pages)), self._last_page_seq())
+                except Exception as e:
+                    metrics.inc("errors_total", kind="render")
+                    print(f"[HTML Render Error] {user['display_name']}: {e}")
+                    self._abort_render(store)
+                    continue
+                finally:
+                    self._page_ops = []
+                rendered.append((peer_id, user["display_name"]))
+            store.commit()
+
+            for peer_id, name in rendered:
+                self._render_changes(store, peer_id, name)
+            with metrics.time("render_deletions"):
+                self._render_deletions(store)
+            store.commit()
+
+    def _render_changes(self, store: EventStore, peer_id: int, name: str) -> None:
+        """Перерисовывает сообщения чата с новыми правками или вложениями."""
+        edits = store.unrendered_edits(peer_id)
+        media = store.unrendered_media(peer_id)
+        if not edits and not media:
+            return
+        changed = dict.fromkeys([(item["chat_id"], item["message_id"]) for item in edits + media])
+        try:
+            chat_folder = self.get_chat_folder_for_existing_user(name, peer_id)
+            pages: dict[int, list[tuple[int, int]]] = {}
+            for chat_id, message_id in changed:
+                location = store.get_message_location(chat_id, message_id)
+                try:
+                    page = location[1] if location else self._find_page_number(chat_folder, message_id)
+                except ValueError as e:
+                    print(f"[HTML Render Error on edit] {name}: {e}")
+                    continue
+                pages.setdefault(page, []).append((chat_id, message_id))
+            with metrics.time("render_edits"):
+                self._rerender_from_store(store, chat_folder, pages)
+        except Exception as e:
+            metrics.inc("errors_total", kind="render")
+            print(f"[HTML Render Error on edit] {name}: {e}")
+        if edits:
+            store.mark_edits_rendered(peer_id, edits[-1]["id"])
+        if media:
+            store.mark_media_rendered(media)
+
+    def _render_deletions(self, store: EventStore) -> None:
+        """Помечает удаленные сообщения на их страницах по индексу сообщений.
+
+        Удаление и само сообщение идут в разных очередях конвейера, поэтому
+        удаление может прийти раньше отрисовки сообщения. Если сообщение уже
+        в базе, удаление остается неотрисованным и применяется после его
+        отрисовки. Если сообщения еще нет, удаление остается в базе, и
+        EventStore.record_message сразу сохранит сообщение удаленным.
+        """
+        deletions = store.unrendered_deletions()
+        chats_dir = self.html_path.parent.parent / "chats"
+        done = []
+        for deletion in deletions:
+            if store.has_unrendered_message(deletion["chat_id"], deletion["message_id"]):
+                continue
+            done.append(deletion["id"])
+            for location in store.locate_deleted_message(deletion["chat_id"], deletion["message_id"]):
+                try:
+                    store.mark_message_deleted(location["id"], deletion["deleted_at"])
+                    self._rerender_from_store(store, self._ensure_hot(chats_dir / location["folder"]),
+                                              {location["page"]: [(location["chat_id"], deletion["message_id"])]})
+                except Exception as e:
+                    metrics.inc("errors_total", kind="render")
+                    print(f"[HTML Render Error on delete] {location['folder']}: {e}")
+        if done:
+            store.mark_deletions_rendered(done)
+
+    def _render_new_messages(self, peer_id: int, name: str, initial: str, messages: list) -> tuple[Path, list[int]]:
+        """Создает чат или дописывает в него новые сообщения и обновляет счетчик.
+
+        Returns:
+            tuple[Path, list[int]]: Папка чата и номера страниц сообщений.
+        """
+        if not self.user_exists(name, peer_id):
+            chat_folder = self.get_next_chat_folder()
+            self._journal_page_op({"kind": "render_chat", "peer_id": peer_id, "name": name, "initial": initial,
+                                   "folder": chat_folder.name, "count_before": 0, "count_after": len(messages)})
+            pages = self.write_messages_paged(chat_folder, name, initial, 0, messages)
+            self.add_user(
+                name=name,
+                initial=initial,
+                href=f"../chats/{chat_folder.name}/messages.html#allow_back",
+                messages_count=len(messages),
+                peer_id=peer_id
+            )
+        else:
+            chat_folder = self.get_chat_folder_for_existing_user(name, peer_id)
+            current_count = self.get_message_count(name, peer_id)
+            self._journal_page_op({"kind": "render_chat", "peer_id": peer_id, "name": name, "initial": initial,
+                                   "folder": chat_folder.name, "count_before": current_count,
+                                   "count_after": current_count + len(messages)})
+            pages = self.write_messages_paged(chat_folder, name, initial, current_count, messages)
+            self.update_message_count(name, current_count + len(messages), peer_id)
+        self._get_entry(name, peer_id).last_message_id = messages[-1]["id"]
+        return chat_folder, pages
+
+    def _archive_path(self, path: Path) -> str:
+        """Возвращает путь файла относительно корня архива (для записей журнала)."""
+        return path.relative_to(self.html_path.parent.parent).as_posix()
+
+    def _journal_page_op(self, record: dict) -> None:
+        """Записывает в журнал операцию над страницами до ее выполнения."""
+        if self.journal is None:
+            return
+        self._page_ops.append({**record, "seq": self.journal.append(record)})
+
+    def _last_page_seq(self) -> Optional[int]:
+        """Возвращает seq последней операции текущей отрисовки чата или None без журнала."""
+        return self._page_ops[-1]["seq"] if self._page_ops else None
+
+    def _rollback_page_ops(self, ops: list[dict]) -> None:
+        """Откатывает операции над страницами в обратном порядке.
+
+        Дописывание отрезается по смещению маркера и заменяется прежним
+        хвостом страницы, созданная страница удаляется.
+        """
+        root = self.html_path.parent.parent
+        for op in reversed(ops):
+            path = root / op.get("path", "")
+            if op["kind"] == "page_append" and path.exists():
+                with open(path, "r+b") as f:
+                    f.seek(op["offset"])
+                    f.write(op["footer"].encode("utf-8"))
+                    f.truncate()
+            elif op["kind"] == "page_create":
+                path.unlink(missing_ok=True)
+            self._tail_offsets.pop(str(path), None)
+
+    def _abort_render(self, store: EventStore) -> None:
+        """Откатывает страницы неудачной отрисовки чата и отмечает это в журнале и хранилище.
+
+        Повторная запись render_chat с неизменным счетчиком и сдвиг отметки
+        rendered не дают восстановлению после сбоя откатить эти операции еще раз.
+        """
+        self._rollback_page_ops(self._page_ops)
+        started = next((op for op in self._page_ops if op["kind"] == "render_chat"), None)
+        if started is None:
+            return
+        self._journal_page_op({key: value for key, value in started.items() if key != "seq"} | {"count_after": started["count_before"]})
+        store.set_journal_mark("rendered", self._last_page_seq())
+
+    def recover(self, records: list[dict], rendered_seq: int) -> int:
+        """Приводит страницы и chats.html в соответствие с хранилищем после сбоя.
+
+        Операции над страницами из журнала с seq больше rendered_seq не
+        учтены в хранилище и откатываются; их сообщения будут отрисованы
+        заново. Счетчики chats.html выставляются по последней учтенной
+        отрисовке каждого чата, так как chats.html записывается отложенно.
+
+        Args:
+            records (list[dict]): Записи журнала по порядку.
+            rendered_seq (int): Отметка rendered из хранилища.
 
-        current_inner_html = text_div.decode_contents()
-        new_inner_html = current_inner_html + f"<br/>edited {new_text}"
-        text_div.clear()
-        text_div.append(BeautifulSoup(new_inner_html, "html.parser"))
+        Returns:
+            int: Число откаченных операций.
+        """
+        with self._lock:
+            undo = [record for record in records
+                    if record["kind"] in ("page_append", "page_create") and record["seq"] > rendered_seq]
+            self._rollback_page_ops(undo)
 
-        if not message_div.find("div", class_="edited"):
-            edited_div = BeautifulSoup('<div class="edited">Edited</div>', "html.parser")
-            message_div.find("div", class_="body").append(edited_div)
+            chats: dict[int, tuple[dict, int]] = {}
+            for record in records:
+                if record["kind"] != "render_chat":
+                    continue
+                if record["seq"] <= rendered_seq:
+                    chats[record["peer_id"]] = (record, record["count_after"])
+                elif record["peer_id"] not in chats or chats[record["peer_id"]][0]["seq"] <= rendered_seq:
+                    chats[record["peer_id"]] = (record, record["count_before"])
 
-        with messages_html.open("w", encoding="utf-8") as f:
-            f.write(str(soup))
\ No newline at end of file
+            for peer_id, (record, count) in chats.items():
+                entry = self._find_entry(record["name"], peer_id)
+                if entry is not None:
+                    if entry.count != count:
+                        self.update_message_count(record["name"], count, peer_id)
+                elif count:
+                    self.add_user(record["name"], record["initial"], f"../chats/{record['folder']}/messages.html#allow_back",
+                                  count, peer_id=peer_id)
+            return len(undo)
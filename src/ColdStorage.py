@@ -0,0 +1,163 @@
+# ColdStorage.py
+# Сжатое хранение страниц неактивных чатов и их восстановление при новой активности.
+import json
+import os
+import shutil
+import tarfile
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from HTMLRenderer import COLD_PAGE
+
+# Каталог сжатых чатов в корне архива и его индекс.
+COLD_DIR_NAME = "cold"
+COLD_INDEX_NAME = "index.json"
+
+
+def disk_usage(path: Path) -> int:
+    """Возвращает место, занятое файлом на диске (по st_blocks, если они есть)."""
+    stat = path.stat()
+    blocks = getattr(stat, "st_blocks", None)
+    return blocks * 512 if blocks is not None else stat.st_size
+
+
+def tree_usage(folder: Path) -> tuple[int, int]:
+    """Возвращает число файлов и место на диске, занятое файлами каталога."""
+    files = [path for path in folder.rglob("*") if path.is_file()]
+    return len(files), sum(disk_usage(path) for path in files)
+
+
+def fsync_tree(folder: Path) -> None:
+    """Сбрасывает на диск файлы каталога и сами каталоги (их записи о файлах).
+
+    Каталоги открываются только на POSIX: в Windows каталог нельзя открыть
+    через os.open, а метаданные NTFS журналируются самой файловой системой.
+    """
+    paths = [folder, *folder.rglob("*")]
+    for path in paths:
+        if path.is_file():
+            with path.open("rb") as f:
+                os.fsync(f.fileno())
+    if os.name == "nt":
+        return
+    for path in paths:
+        if path.is_dir():
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+
+class ColdStorage:
+    """Класс для сжатия папок чатов в cold/chat_NNN.tar.gz и обратного восстановления.
+
+    Вместо папки сжатого чата остается одна страница messages.html со
+    ссылкой на архив, поэтому ссылка из chats.html продолжает работать.
+    Признак сжатого чата — наличие его архива, так что проверка стоит один
+    stat. index.json хранит имя чата, время последней активности и размеры
+    для отчета.
+    """
+
+    def __init__(self, archive_root: Path):
+        """Инициализация хранилища.
+
+        Args:
+            archive_root (Path): Корень архива (каталог с lists/ и chats/).
+        """
+        self.archive_root = archive_root
+        self.cold_dir = archive_root / COLD_DIR_NAME
+        self.index_path = self.cold_dir / COLD_INDEX_NAME
+
+    def archive_path(self, folder: str) -> Path:
+        """Возвращает путь к архиву папки чата."""
+        return self.cold_dir / f"{folder}.tar.gz"
+
+    def is_cold(self, folder: str) -> bool:
+        """Проверяет, сжата ли папка чата."""
+        return self.archive_path(folder).exists()
+
+    def load_index(self) -> dict[str, dict[str, Any]]:
+        """Возвращает индекс сжатых чатов: папка -> сведения о ней."""
+        if not self.index_path.exists():
+            return {}
+        return json.loads(self.index_path.read_text(encoding="utf-8"))
+
+    def _save_index(self, index: dict[str, dict[str, Any]]) -> None:
+        """Записывает индекс через временный файл."""
+        # ChatHTMLManager сам импортирует этот модуль, поэтому импорт здесь, а не в начале файла
+        from ChatHTMLManager import atomic_write_text
+        atomic_write_text(self.index_path, json.dumps(index, ensure_ascii=False, indent=1))
+
+    def compact(self, chat_folder: Path, name: str, last_activity: Optional[str]) -> dict[str, Any]:
+        """Сжимает папку чата в архив и заменяет ее страницей-заглушкой.
+
+        Архив сначала полностью записывается и сбрасывается на диск, и только
+        потом удаляются файлы папки: при сбое на любом шаге страницы остаются
+        либо в папке, либо в архиве.
+
+        Args:
+            chat_folder (Path): Папка чата (chats/chat_NNN).
+            name (str): Имя чата для заглушки и индекса.
+            last_activity (Optional[str]): Время последней активности (ISO) для индекса.
+
+        Returns:
+            dict[str, Any]: Запись индекса: число файлов и место на диске до и после.
+        """
+        if self.is_cold(chat_folder.name):
+            raise ValueError(f"Папка {chat_folder.name} уже сжата")
+        self.cold_dir.mkdir(exist_ok=True)
+        files, original = tree_usage(chat_folder)
+        archive = self.archive_path(chat_folder.name)
+        tmp_path = archive.with_name(archive.name + ".tmp")
+        with tarfile.open(tmp_path, "w:gz", compresslevel=9) as tar:
+            for path in sorted(chat_folder.rglob("*")):
+                tar.add(path, arcname=path.relative_to(chat_folder).as_posix(), recursive=False)
+        with tmp_path.open("rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, archive)
+
+        for path in list(chat_folder.iterdir()):
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+        (chat_folder / "messages.html").write_text(
+            COLD_PAGE.render(name=name, href=f"../../{COLD_DIR_NAME}/{archive.name}"), encoding="utf-8")
+
+        entry = {
+            "name": name,
+            "last_activity": last_activity,
+            "archived_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "files": files,
+            "original_bytes": original,
+            "compressed_bytes": disk_usage(archive) + disk_usage(chat_folder / "messages.html"),
+        }
+        index = self.load_index()
+        index[chat_folder.name] = entry
+        self._save_index(index)
+        return entry
+
+    def rehydrate(self, chat_folder: Path) -> bool:
+        """Восстанавливает папку чата из архива, если она сжата.
+
+        Архив удаляется только после того, как распакованные страницы и папка
+        сброшены на диск (как архив в compact), поэтому прерванное
+        восстановление повторяется при следующем обращении, а после сбоя
+        питания страницы остаются либо в папке, либо в архиве.
+
+        Returns:
+            bool: True, если папка была восстановлена.
+        """
+        archive = self.archive_path(chat_folder.name)
+        if not archive.exists():
+            return False
+        with tarfile.open(archive, "r:gz") as tar:
+            tar.extractall(chat_folder, filter="data")
+        fsync_tree(chat_folder)
+        index = self.load_index()
+        if index.pop(chat_folder.name, None) is not None:
+            self._save_index(index)
+        archive.unlink()
+        return True
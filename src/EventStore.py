@@ -0,0 +1,608 @@
+# EventStore.py
+# Хранилище событий в SQLite — источник истины для HTML-экспорта.
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+# Сообщения нумеруются отдельно в каждом канале и супергруппе, поэтому ключ сообщения —
+# (chat_id, message_id); peer_id — отправитель, по нему сообщения раскладываются по папкам чатов.
+MESSAGES_TABLE = """
+CREATE TABLE IF NOT EXISTS {name} (
+    id INTEGER PRIMARY KEY,
+    peer_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    sender_name TEXT NOT NULL,
+    initial TEXT NOT NULL,
+    text TEXT NOT NULL,
+    date TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    time TEXT NOT NULL,
+    rendered INTEGER NOT NULL DEFAULT 0,
+    chat_id INTEGER NOT NULL,
+    folder TEXT,
+    page INTEGER,
+    deleted_at TEXT,
+    UNIQUE (chat_id, message_id)
+);
+"""
+MESSAGE_COLUMNS = ("id, peer_id, message_id, sender_name, initial, text, date, timestamp, time, rendered, "
+                   "chat_id, folder, page, deleted_at")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    peer_id INTEGER PRIMARY KEY,
+    display_name TEXT NOT NULL,
+    sender_name TEXT NOT NULL,
+    initial TEXT NOT NULL
+);
+""" + MESSAGES_TABLE.format(name="messages") + """
+CREATE INDEX IF NOT EXISTS messages_unrendered ON messages (peer_id) WHERE rendered = 0;
+CREATE INDEX IF NOT EXISTS messages_by_message_id ON messages (message_id);
+CREATE TABLE IF NOT EXISTS edits (
+    id INTEGER PRIMARY KEY,
+    peer_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    edit_date TEXT NOT NULL,
+    rendered INTEGER NOT NULL DEFAULT 0,
+    chat_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS edits_unrendered ON edits (peer_id) WHERE rendered = 0;
+CREATE TABLE IF NOT EXISTS deletions (
+    id INTEGER PRIMARY KEY,
+    chat_id INTEGER,
+    message_id INTEGER NOT NULL,
+    deleted_at TEXT NOT NULL,
+    rendered INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS deletions_message ON deletions (message_id);
+CREATE INDEX IF NOT EXISTS deletions_unrendered ON deletions (id) WHERE rendered = 0;
+CREATE TABLE IF NOT EXISTS media (
+    id INTEGER PRIMARY KEY,
+    peer_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT,
+    mime TEXT,
+    size INTEGER NOT NULL,
+    sha256 TEXT,
+    path TEXT,
+    status TEXT NOT NULL,
+    rendered INTEGER NOT NULL DEFAULT 0,
+    chat_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS media_unrendered ON media (peer_id) WHERE rendered = 0;
+CREATE INDEX IF NOT EXISTS media_pending ON media (id) WHERE status = 'pending';
+CREATE TABLE IF NOT EXISTS backfill_marks (
+    chat_id INTEGER PRIMARY KEY,
+    max_message_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS journal_marks (
+    name TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+);
+"""
+
+# Индексы по колонкам, которых нет в базе старой версии: создаются после миграции.
+CHAT_INDEXES = """
+CREATE INDEX IF NOT EXISTS edits_by_chat ON edits (chat_id, message_id);
+CREATE INDEX IF NOT EXISTS media_by_chat ON media (chat_id, message_id);
+"""
+
+# Полнотекстовый индекс текущего текста сообщений (rowid = messages.id). Триггеры обновляют
+# его в той же транзакции, что и запись сообщения или правки.
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(text, tokenize = 'unicode61 remove_diacritics 2');
+CREATE TRIGGER IF NOT EXISTS message_search_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO message_search (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS message_search_edit AFTER INSERT ON edits BEGIN
+    UPDATE message_search SET text = new.text
+    WHERE rowid = (SELECT id FROM messages WHERE chat_id = new.chat_id AND message_id = new.message_id);
+END;
+"""
+
+# Колонки, добавленные после первой версии схемы: база старой версии дополняется при открытии.
+MIGRATIONS = {
+    "messages": {"chat_id": "INTEGER", "folder": "TEXT", "page": "INTEGER", "deleted_at": "TEXT"},
+    "deletions": {"rendered": "INTEGER NOT NULL DEFAULT 0"},
+    "edits": {"chat_id": "INTEGER"},
+    "media": {"chat_id": "INTEGER"},
+}
+
+# Идентификаторы каналов и супергрупп в формате Telethon меньше этого значения;
+# у них собственная нумерация сообщений, у остальных чатов она общая для аккаунта.
+CHANNEL_ID_LIMIT = -1000000000000
+
+
+class EventStore:
+    """Класс для записи событий (пользователи, сообщения, правки, удаления) в SQLite.
+
+    База работает в режиме WAL, записи группируются в транзакции: коммит
+    выполняется после batch_size изменений или по истечении batch_interval.
+    Соединение общее для всех потоков и защищено блокировкой.
+    """
+
+    def __init__(self, db_path: Path, batch_size: int = 1, batch_interval: float = 0.0):
+        """Открывает (или создает) базу событий.
+
+        Args:
+            db_path (Path): Путь к файлу SQLite.
+            batch_size (int): Число изменений, после которого выполняется коммит.
+            batch_interval (float): Максимальное время жизни незакоммиченной транзакции в секундах.
+        """
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        self.conn.executescript(CHAT_INDEXES)
+        self.search_enabled = self._enable_search()
+        self._lock = threading.RLock()
+        self._pending_changes = 0
+        self._last_commit = time.monotonic()
+
+    def _migrate(self) -> None:
+        """Добавляет недостающие колонки в таблицы базы старой версии."""
+        for table, columns in MIGRATIONS.items():
+            existing = {row["name"] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            for column, declaration in columns.items():
+                if column not in existing:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+        self._rekey_messages()
+
+    def _rekey_messages(self) -> None:
+        """Переводит базу старой версии с ключа (peer_id, message_id) на (chat_id, message_id).
+
+        UNIQUE нельзя изменить через ALTER TABLE, поэтому таблица messages
+        пересоздается с теми же id строк (на них ссылается полнотекстовый
+        индекс). Пустой chat_id заполняется peer_id, chat_id правок и вложений
+        берется из их сообщений. Триггеры поиска пересоздает _enable_search.
+        """
+        row = self.conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'messages'").fetchone()
+        if "UNIQUE (peer_id, message_id)" not in row["sql"]:
+            return
+        self.conn.executescript(f"""
+            BEGIN;
+            DROP TRIGGER IF EXISTS message_search_insert;
+            DROP TRIGGER IF EXISTS message_search_edit;
+            DROP INDEX IF EXISTS edits_message;
+            DROP INDEX IF EXISTS media_message;
+            UPDATE messages SET chat_id = peer_id WHERE chat_id IS NULL;
+            UPDATE edits SET chat_id = COALESCE((SELECT m.chat_id FROM messages m WHERE m.peer_id = edits.peer_id
+                                                 AND m.message_id = edits.message_id), peer_id);
+            UPDATE media SET chat_id = COALESCE((SELECT m.chat_id FROM messages m WHERE m.peer_id = media.peer_id
+                                                 AND m.message_id = media.message_id), peer_id);
+            {MESSAGES_TABLE.format(name="messages_rekeyed")}
+            INSERT OR IGNORE INTO messages_rekeyed ({MESSAGE_COLUMNS}) SELECT {MESSAGE_COLUMNS} FROM messages;
+            DROP TABLE messages;
+            ALTER TABLE messages_rekeyed RENAME TO messages;
+            COMMIT;
+        """)
+        self.conn.executescript(SCHEMA)
+
+    def _enable_search(self) -> bool:
+        """Создает полнотекстовый индекс; для базы старой версии заполняет его текущими текстами.
+
+        Returns:
+            bool: False, если SQLite собран без FTS5.
+        """
+        exists = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'message_search'").fetchone()
+        try:
+            self.conn.executescript(SEARCH_SCHEMA)
+        except sqlite3.OperationalError:
+            return False
+        if not exists:
+            self.conn.execute(
+                """INSERT INTO message_search (rowid, text)
+                   SELECT m.id, COALESCE((SELECT e.text FROM edits e WHERE e.chat_id = m.chat_id
+                                          AND e.message_id = m.message_id ORDER BY e.id DESC LIMIT 1), m.text)
+                   FROM messages m"""
+            )
+        return True
+
+    def configure_batching(self, batch_interval: float, batch_size: int) -> None:
+        """Настраивает размер и длительность пакетных транзакций."""
+        self.batch_interval = batch_interval
+        self.batch_size = batch_size
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        """Выполняет изменяющий запрос внутри текущей пакетной транзакции."""
+        with self._lock:
+            if not self.conn.in_transaction:
+                self.conn.execute("BEGIN")
+            self._pending_changes += 1
+            return self.conn.execute(sql, params)
+
+    def _executemany(self, sql: str, rows: list[tuple]) -> None:
+        """Выполняет изменяющий запрос для нескольких наборов параметров."""
+        with self._lock:
+            if not self.conn.in_transaction:
+                self.conn.execute("BEGIN")
+            self._pending_changes += len(rows)
+            self.conn.executemany(sql, rows)
+
+    def _query(self, sql: str, params: tuple = ()) -> list[sqlite3.Row]:
+        """Выполняет читающий запрос и возвращает все строки."""
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def commit_if_due(self) -> bool:
+        """Коммитит транзакцию, если набралось batch_size изменений или истек batch_interval.
+
+        Returns:
+            bool: True, если коммит был выполнен.
+        """
+        with self._lock:
+            if not self._pending_changes:
+                return False
+            if self._pending_changes >= self.batch_size or time.monotonic() - self._last_commit >= self.batch_interval:
+                self.commit()
+                return True
+            return False
+
+    def commit(self) -> None:
+        """Коммитит текущую транзакцию."""
+        with self._lock:
+            if self.conn.in_transaction:
+                self.conn.execute("COMMIT")
+            self._pending_changes = 0
+            self._last_commit = time.monotonic()
+
+    def close(self) -> None:
+        """Коммитит изменения и закрывает соединение."""
+        with self._lock:
+            self.commit()
+            self.conn.close()
+
+    def record_user(self, peer_id: int, display_name: str, sender_name: str, initial: str) -> None:
+        """Сохраняет или обновляет данные пользователя."""
+        self._execute(
+            """INSERT INTO users (peer_id, display_name, sender_name, initial) VALUES (?, ?, ?, ?)
+               ON CONFLICT (peer_id) DO UPDATE SET display_name = excluded.display_name,
+               sender_name = excluded.sender_name, initial = excluded.initial""",
+            (peer_id, display_name, sender_name, initial),
+        )
+
+    def record_message(self, peer_id: int, message_data: dict) -> None:
+        """Сохраняет новое сообщение. Повторная запись того же сообщения чата игнорируется.
+
+        Без chat_id (записи журнала старой версии) чатом считается отправитель.
+        Удаление и сообщение обрабатываются в разных очередях, поэтому удаление
+        может быть записано раньше самого сообщения: такое сообщение сразу
+        сохраняется удаленным (чаты подбираются как в locate_deleted_message).
+        """
+        chat_id = peer_id if message_data.get("chat_id") is None else message_data["chat_id"]
+        self._execute(
+            """INSERT OR IGNORE INTO messages
+               (peer_id, message_id, chat_id, sender_name, initial, text, date, timestamp, time, deleted_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?,
+                       (SELECT deleted_at FROM deletions WHERE message_id = ?
+                        AND (chat_id = ? OR (chat_id IS NULL AND ? > ?)) ORDER BY id LIMIT 1))""",
+            (peer_id, message_data["id"], chat_id, message_data["sender_name"],
+             message_data["initial"], message_data["text"], message_data["date"],
+             message_data["timestamp"], message_data["time"],
+             message_data["id"], chat_id, chat_id, CHANNEL_ID_LIMIT),
+        )
+
+    def record_edit(self, peer_id: int, chat_id: Optional[int], message_id: int, text: str, edit_date: str) -> None:
+        """Сохраняет новую версию текста сообщения чата. Повтор той же версии игнорируется."""
+        chat_id = peer_id if chat_id is None else chat_id
+        self._execute(
+            """INSERT INTO edits (peer_id, chat_id, message_id, text, edit_date) SELECT ?, ?, ?, ?, ?
+               WHERE NOT EXISTS (SELECT 1 FROM edits WHERE chat_id = ? AND message_id = ? AND text = ? AND edit_date = ?)""",
+            (peer_id, chat_id, message_id, text, edit_date, chat_id, message_id, text, edit_date),
+        )
+
+    def record_deletion(self, chat_id: Optional[int], message_id: int, deleted_at: str) -> None:
+        """Сохраняет факт удаления сообщения. Повторное удаление игнорируется."""
+        self._execute(
+            """INSERT INTO deletions (chat_id, message_id, deleted_at) SELECT ?, ?, ?
+               WHERE NOT EXISTS (SELECT 1 FROM deletions WHERE chat_id IS ? AND message_id = ?)""",
+            (chat_id, message_id, deleted_at, chat_id, message_id),
+        )
+
+    def get_user(self, peer_id: int) -> Optional[dict[str, Any]]:
+        """Возвращает данные пользователя по peer id."""
+        rows = self._query("SELECT * FROM users WHERE peer_id = ?", (peer_id,))
+        return dict(rows[0]) if rows else None
+
+    def dirty_peers(self) -> list[int]:
+        """Возвращает peer id чатов с неотрисованными сообщениями, правками или вложениями."""
+        rows = self._query(
+            """SELECT peer_id FROM messages WHERE rendered = 0
+               UNION SELECT peer_id FROM edits WHERE rendered = 0
+               UNION SELECT peer_id FROM media WHERE rendered = 0"""
+        )
+        return [row["peer_id"] for row in rows]
+
+    def unrendered_messages(self, peer_id: int) -> list[dict[str, Any]]:
+        """Возвращает неотрисованные сообщения чата в порядке поступления."""
+        rows = self._query("SELECT * FROM messages WHERE peer_id = ? AND rendered = 0 ORDER BY id", (peer_id,))
+        return [dict(row, id=row["message_id"], rowid=row["id"]) for row in rows]
+
+    def unrendered_edits(self, peer_id: int) -> list[dict[str, Any]]:
+        """Возвращает неотрисованные правки чата в порядке поступления."""
+        rows = self._query("SELECT * FROM edits WHERE peer_id = ? AND rendered = 0 ORDER BY id", (peer_id,))
+        return [dict(row) for row in rows]
+
+    def mark_messages_rendered(self, folder: str, locations: list[tuple[int, int]], journal_seq: Optional[int] = None) -> None:
+        """Помечает сообщения отрисованными и запоминает, где они лежат.
+
+        Args:
+            folder (str): Имя папки чата (chat_001).
+            locations (list[tuple[int, int]]): Пары (rowid сообщения, номер страницы).
+            journal_seq (Optional[int]): Последняя запись журнала об изменении страниц; сохраняется
+                в той же транзакции, чтобы после сбоя не откатить уже учтенные записи.
+        """
+        with self._lock:
+            self._executemany(
+                "UPDATE messages SET rendered = 1, folder = ?, page = ? WHERE id = ?",
+                [(folder, page, rowid) for rowid, page in locations],
+            )
+            if journal_seq is not None:
+                self.set_journal_mark("rendered", journal_seq)
+
+    def get_message(self, chat_id: int, message_id: int) -> Optional[dict[str, Any]]:
+        """Возвращает исходную версию сообщения чата или None."""
+        rows = self._query("SELECT * FROM messages WHERE chat_id = ? AND message_id = ?", (chat_id, message_id))
+        return dict(rows[0], id=rows[0]["message_id"], rowid=rows[0]["id"]) if rows else None
+
+    def get_versions(self, chat_id: int, message_id: int) -> list[dict[str, Any]]:
+        """Возвращает правки сообщения чата по порядку (по индексу edits_by_chat)."""
+        rows = self._query(
+            "SELECT text, edit_date FROM edits WHERE chat_id = ? AND message_id = ? ORDER BY id",
+            (chat_id, message_id),
+        )
+        return [dict(row) for row in rows]
+
+    def chat_activity(self) -> dict[str, str]:
+        """Возвращает дату (ISO) последнего сообщения каждой папки чата."""
+        rows = self._query("SELECT folder, MAX(date) AS last_date FROM messages WHERE folder IS NOT NULL GROUP BY folder")
+        return {row["folder"]: row["last_date"] for row in rows}
+
+    def get_message_location(self, chat_id: int, message_id: int) -> Optional[tuple[str, int]]:
+        """Возвращает папку и страницу отрисованного сообщения чата или None."""
+        rows = self._query(
+            "SELECT folder, page FROM messages WHERE chat_id = ? AND message_id = ? AND folder IS NOT NULL",
+            (chat_id, message_id),
+        )
+        return (rows[0]["folder"], rows[0]["page"]) if rows else None
+
+    def page_occurrence(self, rowid: int) -> int:
+        """Возвращает, сколько сообщений с тем же id из других чатов лежит на той же странице раньше этого.
+
+        У одного отправителя на странице могут оказаться сообщения с одинаковым
+        id из разных супергрупп; их блоки различаются по порядку на странице.
+        """
+        rows = self._query(
+            """SELECT COUNT(*) AS n FROM messages m JOIN messages o ON o.message_id = m.message_id
+               AND o.folder = m.folder AND o.page = m.page AND o.id < m.id WHERE m.id = ?""",
+            (rowid,),
+        )
+        return rows[0]["n"]
+
+    def locate_deleted_message(self, chat_id: Optional[int], message_id: int) -> list[dict[str, Any]]:
+        """Находит отрисованные сообщения, к которым относится удаление.
+
+        Telegram сообщает chat_id только для каналов и супергрупп; без него
+        ищутся сообщения всех остальных чатов с этим id.
+        """
+        if chat_id is not None:
+            rows = self._query(
+                "SELECT id, peer_id, chat_id, folder, page FROM messages WHERE message_id = ? AND chat_id = ? AND folder IS NOT NULL",
+                (message_id, chat_id),
+            )
+        else:
+            rows = self._query(
+                """SELECT id, peer_id, chat_id, folder, page FROM messages WHERE message_id = ? AND folder IS NOT NULL
+                   AND (chat_id IS NULL OR chat_id > ?)""",
+                (message_id, CHANNEL_ID_LIMIT),
+            )
+        return [dict(row) for row in rows]
+
+    def has_unrendered_message(self, chat_id: Optional[int], message_id: int) -> bool:
+        """Проверяет, есть ли еще не отрисованное сообщение, к которому может относиться удаление.
+
+        Чаты подбираются так же, как в locate_deleted_message.
+        """
+        if chat_id is not None:
+            rows = self._query(
+                "SELECT 1 FROM messages WHERE message_id = ? AND chat_id = ? AND rendered = 0 LIMIT 1",
+                (message_id, chat_id),
+            )
+        else:
+            rows = self._query(
+                """SELECT 1 FROM messages WHERE message_id = ? AND rendered = 0
+                   AND (chat_id IS NULL OR chat_id > ?) LIMIT 1""",
+                (message_id, CHANNEL_ID_LIMIT),
+            )
+        return bool(rows)
+
+    def unrendered_deletions(self) -> list[dict[str, Any]]:
+        """Возвращает неотрисованные удаления в порядке поступления."""
+        rows = self._query("SELECT * FROM deletions WHERE rendered = 0 ORDER BY id")
+        return [dict(row) for row in rows]
+
+    def mark_message_deleted(self, rowid: int, deleted_at: str) -> None:
+        """Помечает сообщение удаленным."""
+        self._execute("UPDATE messages SET deleted_at = ? WHERE id = ?", (deleted_at, rowid))
+
+    def mark_deletions_rendered(self, ids: list[int]) -> None:
+        """Помечает удаления с указанными id строк как отрисованные."""
+        self._executemany("UPDATE deletions SET rendered = 1 WHERE id = ?", [(deletion_id,) for deletion_id in ids])
+
+    def mark_edits_rendered(self, peer_id: int, up_to: int) -> None:
+        """Помечает правки чата до строки up_to включительно как отрисованные."""
+        self._execute("UPDATE edits SET rendered = 1 WHERE peer_id = ? AND rendered = 0 AND id <= ?", (peer_id, up_to))
+
+    def record_media(self, peer_id: int, chat_id: Optional[int], message_id: int, media: dict) -> None:
+        """Сохраняет вложение сообщения чата (скачанное, пропущенное или отложенное).
+
+        Итог загрузки заменяет отложенную (pending) запись и снова отдает
+        вложение на отрисовку; остальные повторные записи игнорируются.
+        """
+        chat_id = peer_id if chat_id is None else chat_id
+        with self._lock:
+            if media["status"] != "pending":
+                self._execute(
+                    """UPDATE media SET kind = ?, name = ?, mime = ?, size = ?, sha256 = ?, path = ?, status = ?, rendered = 0
+                       WHERE chat_id = ? AND message_id = ? AND status = 'pending'""",
+                    (media["media_kind"], media["name"], media["mime"], media["size"], media["sha256"],
+                     media["path"], media["status"], chat_id, message_id),
+                )
+            self._execute(
+                """INSERT INTO media (peer_id, chat_id, message_id, kind, name, mime, size, sha256, path, status)
+                   SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+                   WHERE NOT EXISTS (SELECT 1 FROM media WHERE chat_id = ? AND message_id = ?)""",
+                (peer_id, chat_id, message_id, media["media_kind"], media["name"], media["mime"], media["size"],
+                 media["sha256"], media["path"], media["status"], chat_id, message_id),
+            )
+
+    def get_media(self, chat_id: int, message_id: int) -> list[dict[str, Any]]:
+        """Возвращает вложения сообщения чата."""
+        rows = self._query("SELECT * FROM media WHERE chat_id = ? AND message_id = ? ORDER BY id", (chat_id, message_id))
+        return [dict(row) for row in rows]
+
+    def unrendered_media(self, peer_id: int) -> list[dict[str, Any]]:
+        """Возвращает неотрисованные вложения чата в порядке поступления."""
+        rows = self._query("SELECT * FROM media WHERE peer_id = ? AND rendered = 0 ORDER BY id", (peer_id,))
+        return [dict(row) for row in rows]
+
+    def mark_media_rendered(self, media: list[dict[str, Any]]) -> None:
+        """Помечает отрисованными вложения из unrendered_media, если их статус с тех пор не изменился.
+
+        Отложенная запись, замененная итогом загрузки, снова становится
+        неотрисованной со своим старым id, поэтому отметка идет по id и статусу.
+        """
+        self._executemany("UPDATE media SET rendered = 1 WHERE id = ? AND status = ?",
+                          [(item["id"], item["status"]) for item in media])
+
+    def pending_media(self) -> list[dict[str, Any]]:
+        """Возвращает отложенные вложения (очередь загрузки была заполнена) в порядке поступления."""
+        rows = self._query("SELECT * FROM media WHERE status = 'pending' ORDER BY id")
+        return [dict(row) for row in rows]
+
+    def media_bytes(self, peer_id: Optional[int] = None) -> int:
+        """Возвращает объем сохраненных вложений: чата (все вложения) или общий (уникальные файлы)."""
+        if peer_id is not None:
+            rows = self._query("SELECT COALESCE(SUM(size), 0) AS total FROM media WHERE peer_id = ? AND status = 'stored'", (peer_id,))
+        else:
+            rows = self._query(
+                """SELECT COALESCE(SUM(size), 0) AS total FROM
+                   (SELECT MAX(size) AS size FROM media WHERE status = 'stored' GROUP BY sha256)"""
+            )
+        return rows[0]["total"]
+
+    def get_backfill_mark(self, chat_id: int) -> int:
+        """Возвращает id последнего загруженного сообщения диалога (0, если загрузки не было)."""
+        rows = self._query("SELECT max_message_id FROM backfill_marks WHERE chat_id = ?", (chat_id,))
+        return rows[0]["max_message_id"] if rows else 0
+
+    def set_backfill_mark(self, chat_id: int, max_message_id: int) -> None:
+        """Запоминает id последнего загруженного сообщения диалога в текущей транзакции."""
+        self._execute(
+            """INSERT INTO backfill_marks (chat_id, max_message_id) VALUES (?, ?)
+               ON CONFLICT (chat_id) DO UPDATE SET max_message_id = MAX(max_message_id, excluded.max_message_id)""",
+            (chat_id, max_message_id),
+        )
+
+    def get_journal_mark(self, name: str) -> int:
+        """Возвращает seq журнала, до которого учтены записи (applied — события, rendered — страницы)."""
+        rows = self._query("SELECT seq FROM journal_marks WHERE name = ?", (name,))
+        return rows[0]["seq"] if rows else 0
+
+    def set_journal_mark(self, name: str, seq: int) -> None:
+        """Запоминает seq журнала в текущей транзакции; отметка только растет."""
+        self._execute(
+            """INSERT INTO journal_marks (name, seq) VALUES (?, ?)
+               ON CONFLICT (name) DO UPDATE SET seq = MAX(seq, excluded.seq)""",
+            (name, seq),
+        )
+
+    def commit_journal_marks(self) -> dict[str, int]:
+        """Коммитит транзакцию и возвращает отметки журнала, которые теперь точно на диске."""
+        with self._lock:
+            self.commit()
+            return {row["name"]: row["seq"] for row in self._query("SELECT name, seq FROM journal_marks")}
+
+    def search(self, match: str, chat: Optional[str] = None, sender: Optional[str] = None,
+               since: Optional[str] = None, until: Optional[str] = None, limit: int = 50) -> list[dict[str, Any]]:
+        """Ищет сообщения по полнотекстовому индексу, лучшие совпадения первыми.
+
+        Args:
+            match (str): Запрос в синтаксисе FTS5 MATCH.
+            chat (Optional[str]): peer id чата или часть его имени.
+            sender (Optional[str]): Часть имени отправителя.
+            since (Optional[str]): Дата ISO, начиная с которой искать (включительно).
+            until (Optional[str]): Дата ISO, до которой искать (не включительно).
+            limit (int): Максимум результатов.
+        """
+        if not self.search_enabled:
+            raise RuntimeError("❌ SQLite собран без FTS5, поиск недоступен")
+        conditions = ["message_search MATCH ?"]
+        params: list[Any] = [match]
+        if chat:
+            conditions.append("(m.peer_id = ? OR u.display_name LIKE ?)")
+            params += [int(chat) if chat.lstrip("-").isdigit() else None, f"%{chat}%"]
+        if sender:
+            conditions.append("m.sender_name LIKE ?")
+            params.append(f"%{sender}%")
+        if since:
+            conditions.append("m.date >= ?")
+            params.append(since)
+        if until:
+            conditions.append("m.date < ?")
+            params.append(until)
+        rows = self._query(
+            f"""SELECT m.id AS rowid, m.peer_id, m.message_id, u.display_name AS chat_name, m.sender_name, m.date,
+                       m.timestamp, m.folder, m.page, m.deleted_at,
+                       snippet(message_search, 0, '[', ']', '…', 12) AS snippet
+                FROM message_search JOIN messages m ON m.id = message_search.rowid
+                LEFT JOIN users u ON u.peer_id = m.peer_id
+                WHERE {" AND ".join(conditions)}
+                ORDER BY message_search.rank LIMIT ?""",
+            (*params, limit),
+        )
+        return [dict(row) for row in rows]
+
+    def search_documents(self, batch_size: int = 10000) -> Iterator[dict[str, Any]]:
+        """Перебирает отрисованные сообщения с текущим текстом для статического индекса поиска, по rowid.
+
+        Сообщения читаются порциями по batch_size, соединение между порциями свободно.
+        """
+        last = 0
+        while True:
+            rows = self._query(
+                """SELECT m.id AS rowid, m.peer_id, m.message_id, u.display_name AS chat_name, m.sender_name, m.date,
+                          m.timestamp, m.folder, m.page, m.deleted_at, s.text
+                   FROM messages m JOIN message_search s ON s.rowid = m.id
+                   LEFT JOIN users u ON u.peer_id = m.peer_id
+                   WHERE m.folder IS NOT NULL AND m.id > ? ORDER BY m.id LIMIT ?""",
+                (last, batch_size),
+            )
+            if not rows:
+                return
+            for row in rows:
+                yield dict(row)
+            last = rows[-1]["rowid"]
+
+    def search_postings(self) -> Iterator[tuple[str, int]]:
+        """Перебирает пары (слово, rowid отрисованного сообщения) из полнотекстового индекса, по словам.
+
+        Пары читаются курсором, поэтому соединение занято до конца перебора.
+        """
+        with self._lock:
+            self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp.message_search_terms USING fts5vocab(main, message_search, instance)")
+            cursor = self.conn.execute(
+                """SELECT DISTINCT term, doc FROM temp.message_search_terms
+                   WHERE doc IN (SELECT id FROM messages WHERE folder IS NOT NULL) ORDER BY term, doc"""
+            )
+            for row in cursor:
+                yield row["term"], row["doc"]
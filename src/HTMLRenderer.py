@@ -0,0 +1,485 @@
+# HTMLRenderer.py
+# Шаблоны HTML архива: разбираются один раз при импорте, значения экранируются при записи.
+import copy
+import re
+from html import escape
+from string import Formatter
+from typing import Callable, Optional
+
+from bs4 import BeautifulSoup, Tag
+
+# Маркер конца истории сообщений: новые сообщения дописываются перед ним.
+HISTORY_END_COMMENT = "history_end"
+HISTORY_END_MARKER = f"<!--{HISTORY_END_COMMENT}-->"
+# Путь от страницы чата (chats/chat_NNN/) до каталога вложений media/.
+MEDIA_HREF_PREFIX = "../../media/"
+
+# Символы, требующие экранирования; строки без них подставляются как есть.
+NEEDS_ESCAPE = re.compile(r"[&<>\"']")
+
+# Функция записи фрагмента: file.write, io.StringIO.write или list.append.
+Write = Callable[[str], object]
+
+
+class Template:
+    """Шаблон с полями {name}, подготовленный один раз при импорте.
+
+    Строковые значения полей экранируются html.escape; поля с суффиксом
+    _html вставляются как есть (уже отрисованные фрагменты), числа
+    форматируются без экранирования.
+    """
+
+    def __init__(self, source: str):
+        """Разбирает шаблон на литералы и поля.
+
+        Args:
+            source (str): Текст шаблона в синтаксисе str.format ({{ и }} — литеральные скобки).
+        """
+        self.source = source
+        self.parts: list[tuple[str, Optional[str], bool]] = [
+            (literal, field, field is not None and field.endswith("_html"))
+            for literal, field, _, _ in Formatter().parse(source)
+        ]
+
+    def render(self, **values) -> str:
+        """Возвращает шаблон с подставленными значениями строкой."""
+        out = []
+        for literal, field, raw in self.parts:
+            out.append(literal)
+            if field is not None:
+                value = values[field]
+                if type(value) is not str:
+                    value = str(value)
+                elif not raw and NEEDS_ESCAPE.search(value):
+                    value = escape(value)
+                out.append(value)
+        return "".join(out)
+
+    def write(self, write: Write, **values) -> None:
+        """Записывает шаблон с подставленными значениями через write."""
+        write(self.render(**values))
+
+
+PAGE_HEADER = Template("""<!DOCTYPE html>
+<html>
+ <head>
+  <meta charset="utf-8"/>
+  <title>Exported Data</title>
+  <meta content="width=device-width, initial-scale=1.0" name="viewport"/>
+  <link href="../../css/style.css" rel="stylesheet"/>
+  <script src="../../js/script.js" type="text/javascript"></script>
+ </head>
+ <body onload="CheckLocation();">
+  <div class="page_wrap">
+   <div class="page_header">
+    <a class="content block_link" href="../../lists/chats.html" onclick="return GoBack(this)">
+     <div class="text bold">{name}</div>
+    </a>
+   </div>
+   <div class="page_body chat_page">
+    <div class="history">
+""")
+
+PAGE_FOOTER = Template(f"""
+    {HISTORY_END_MARKER}
+    </div>
+   </div>
+  </div>
+ </body>
+</html>
+""")
+
+PREVIOUS_LINK = Template("""
+     <a class="pagination block_link" href="{href}">
+      Previous messages
+     </a>
+""")
+
+NEXT_LINK = Template("""
+     <a class="pagination block_link" href="{href}">
+      Next messages
+     </a>
+""")
+
+MESSAGE = Template("""
+     <!--m{id}-->
+     <div class="{classes}" id="message{id}">
+      <div class="pull_left userpic_wrap">
+       <div class="userpic userpic7" style="width: 42px; height: 42px">
+        <div class="initials" style="line-height: 42px">{initial}</div>
+       </div>
+      </div>
+      <div class="body">
+       <div class="pull_right date details" title="{timestamp}">
+        {time}
+       </div>
+       <div class="from_name">{sender_name}</div>{media_html}
+       <div class="text">{text_html}</div>{extra_html}
+      </div>
+     </div>
+     <!--/m{id}-->
+""")
+
+EDIT_HISTORY_HEAD = Template("""
+       <details class="edit_history">
+        <summary class="edited details">edited {edit_date}</summary>""")
+
+EDIT_HISTORY_VERSION = Template("""
+        <div class="version">
+         <div class="pull_right date details">{edit_date}</div>
+         <div class="text">{text_html}</div>
+        </div>""")
+
+EDIT_HISTORY_TAIL = Template("""
+       </details>""")
+
+DELETED_NOTE = Template("""
+       <div class="deleted">Deleted {deleted_at}</div>""")
+
+MEDIA_SKIPPED = Template("""
+       <div class="media_wrap clearfix">
+        <div class="media clearfix pull_left media_file">
+         <div class="body">
+          <div class="title bold">{title}</div>
+          <div class="status details">{status}</div>
+         </div>
+        </div>
+       </div>""")
+
+MEDIA_PHOTO = Template("""
+       <div class="media_wrap clearfix">
+        <a class="photo_wrap clearfix pull_left" href="{href}">
+         <img class="photo" src="{href}" style="max-width: 260px"/>
+        </a>
+       </div>""")
+
+MEDIA_FILE = Template("""
+       <div class="media_wrap clearfix">
+        <a class="media clearfix pull_left block_link media_file" href="{href}">
+         <div class="body">
+          <div class="title bold">{title}</div>
+          <div class="status details">{size}</div>
+         </div>
+        </a>
+       </div>""")
+
+# Заглушка вместо страниц сжатого чата (см. ColdStorage); маркера конца истории в ней нет,
+# поэтому дописать в нее сообщения по ошибке нельзя.
+COLD_PAGE = Template("""<!DOCTYPE html>
+<html>
+ <head>
+  <meta charset="utf-8"/>
+  <title>Exported Data</title>
+  <meta content="width=device-width, initial-scale=1.0" name="viewport"/>
+  <link href="../../css/style.css" rel="stylesheet"/>
+ </head>
+ <body>
+  <div class="page_wrap">
+   <div class="page_header">
+    <a class="content block_link" href="../../lists/chats.html">
+     <div class="text bold">{name}</div>
+    </a>
+   </div>
+   <div class="page_body chat_page">
+    <div class="details" style="padding: 20px">
+     This chat is archived: <a href="{href}">{href}</a>.
+     It is restored automatically on new activity, or with python compact.py --restore.
+    </div>
+   </div>
+  </div>
+ </body>
+</html>
+""")
+
+# Запись чата в chats.html; разбирается один раз, новые записи — ее копии.
+CHAT_ENTRY = BeautifulSoup("""
+        <a class="entry block_link clearfix" href="">
+          <div class="pull_left userpic_wrap">
+           <div class="userpic userpic7" style="width: 48px; height: 48px">
+            <div class="initials" style="line-height: 48px"></div>
+           </div>
+          </div>
+          <div class="body">
+           <div class="pull_right info details"></div>
+           <div class="name bold"></div>
+           <div class="details_entry details"></div>
+          </div>
+        </a>
+        """, "html.parser").find("a")
+
+# Страница поиска lists/search.html по статическому индексу search/ (см. SearchIndex.export_search_index).
+# Шарды подключаются тегами <script>, поэтому страница работает и при открытии архива с диска (file://).
+# Слова разбиваются так же, как токенизатор unicode61 remove_diacritics 2 в SQLite.
+SEARCH_PAGE = """<!DOCTYPE html>
+<html>
+ <head>
+  <meta charset="utf-8"/>
+  <title>Search</title>
+  <meta content="width=device-width, initial-scale=1.0" name="viewport"/>
+  <link href="../css/style.css" rel="stylesheet"/>
+ </head>
+ <body>
+  <div class="page_wrap">
+   <div class="page_header">
+    <a class="content block_link" href="chats.html">
+     <div class="text bold">Search</div>
+    </a>
+   </div>
+   <div class="page_body list_page">
+    <form id="search_form" class="search_form" style="padding: 10px 20px">
+     <input id="search_query" type="search" placeholder="Search messages" autofocus/>
+     <select id="search_chat"><option value="">All chats</option></select>
+     <input id="search_sender" type="text" placeholder="Sender"/>
+     <input id="search_since" type="date"/>
+     <input id="search_until" type="date"/>
+     <button type="submit">Search</button>
+    </form>
+    <div id="search_status" class="details" style="padding: 0 20px"></div>
+    <div id="search_results" class="history"></div>
+   </div>
+  </div>
+  <script type="text/javascript">
+var archiveSearch = (function () {
+  var MAX_RESULTS = 100;
+  var loaded = {manifest: null, terms: {}, docs: {}};
+  var pending = {};
+
+  function load(src) {
+    if (!pending[src]) {
+      pending[src] = new Promise(function (resolve) {
+        var script = document.createElement("script");
+        script.src = "../search/" + src;
+        script.onload = script.onerror = function () { resolve(); };
+        document.head.appendChild(script);
+      });
+    }
+    return pending[src];
+  }
+
+  function tokenize(text) {
+    text = text.toLowerCase().replace(/[\u00C0-\u024F\u1E00-\u1EFF]/g, function (c) {
+      return c.normalize("NFD").charAt(0);
+    });
+    return text.match(/[\p{L}\p{N}]+/gu) || [];
+  }
+
+  function shardKey(term) {
+    var bytes = new TextEncoder().encode(Array.from(term).slice(0, 2).join(""));
+    return Array.from(bytes, function (b) { return b.toString(16).padStart(2, "0"); }).join("");
+  }
+
+  function shardKeys(term, prefix) {
+    // Слова лежат в шарде по своим первым двум символам: префикс из одного символа
+    // может продолжаться в любом шарде, ключ которого начинается с его ключа.
+    var key = shardKey(term);
+    if (!prefix || Array.from(term).length > 1 || !loaded.manifest.term_shards) return [key];
+    return loaded.manifest.term_shards.filter(function (k) { return k.startsWith(key); });
+  }
+
+  async function matching(term, prefix) {
+    var keys = shardKeys(term, prefix);
+    await Promise.all(keys.map(function (key) { return load("terms/" + key + ".js"); }));
+    var ids = new Set();
+    keys.forEach(function (key) {
+      var shard = loaded.terms[key] || {};
+      Object.keys(shard).forEach(function (t) {
+        if (t === term || (prefix && t.startsWith(term))) {
+          shard[t].forEach(function (id) { ids.add(id); });
+        }
+      });
+    });
+    return ids;
+  }
+
+  async function doc(id) {
+    var number = Math.floor(id / loaded.manifest.docs_per_shard);
+    await load("docs/" + number + ".js");
+    return (loaded.docs[number] || {})[id];
+  }
+
+  function pageHref(folder, page, messageId) {
+    return "../chats/" + folder + "/" + (page === 1 ? "messages.html" : "messages" + page + ".html") + "#message" + messageId;
+  }
+
+  function element(tag, className, text) {
+    var node = document.createElement(tag);
+    if (className) node.className = className;
+    if (text !== undefined) node.textContent = text;
+    return node;
+  }
+
+  function show(d) {
+    var chat = loaded.manifest.chats[d[0]];
+    var link = element("a", "message default clearfix block_link" + (d[6] ? " deleted" : ""));
+    link.href = pageHref(chat[0], d[2], d[1]);
+    var body = element("div", "body");
+    body.appendChild(element("div", "pull_right date details", d[5]));
+    body.appendChild(element("div", "from_name", chat[1] + " \u2014 " + d[3]));
+    body.appendChild(element("div", "text", d[7]));
+    link.appendChild(body);
+    document.getElementById("search_results").appendChild(link);
+  }
+
+  async function run(event) {
+    event.preventDefault();
+    var results = document.getElementById("search_results");
+    var status = document.getElementById("search_status");
+    results.textContent = "";
+    var terms = tokenize(document.getElementById("search_query").value);
+    if (!terms.length) return;
+    status.textContent = "Searching...";
+    var found = null;
+    for (var i = 0; i < terms.length; i++) {
+      var ids = await matching(terms[i], i === terms.length - 1);
+      found = found === null ? ids : new Set(Array.from(found).filter(function (id) { return ids.has(id); }));
+    }
+    var chat = document.getElementById("search_chat").value;
+    var sender = document.getElementById("search_sender").value.toLowerCase();
+    var since = document.getElementById("search_since").value;
+    var until = document.getElementById("search_until").value;
+    var shown = 0;
+    var ordered = Array.from(found).sort(function (a, b) { return b - a; });
+    for (var j = 0; j < ordered.length && shown < MAX_RESULTS; j++) {
+      var d = await doc(ordered[j]);
+      var day = d ? d[4].slice(0, 10) : "";
+      if (!d || (chat && d[0] !== Number(chat)) || (sender && d[3].toLowerCase().indexOf(sender) < 0)
+          || (since && day < since) || (until && day > until)) continue;
+      show(d);
+      shown++;
+    }
+    status.textContent = shown ? "Found: " + shown + (shown === MAX_RESULTS ? "+" : "") : "Nothing found";
+  }
+
+  window.addEventListener("DOMContentLoaded", async function () {
+    await load("manifest.js");
+    var status = document.getElementById("search_status");
+    if (!loaded.manifest) {
+      status.textContent = "Search index not found: run python search.py --export";
+      return;
+    }
+    var select = document.getElementById("search_chat");
+    loaded.manifest.chats.forEach(function (chat, index) {
+      var option = element("option", null, chat[1]);
+      option.value = index;
+      select.appendChild(option);
+    });
+    status.textContent = "Messages indexed: " + loaded.manifest.messages;
+    document.getElementById("search_form").addEventListener("submit", run);
+  });
+
+  return {
+    manifest: function (data) { loaded.manifest = data; },
+    terms: function (key, data) { loaded.terms[key] = data; },
+    docs: function (number, data) { loaded.docs[number] = data; }
+  };
+})();
+  </script>
+ </body>
+</html>
+"""
+
+
+def format_size(size: int) -> str:
+    """Форматирует размер файла: 512 B, 1.5 KB, 3.2 MB."""
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def text_html(text: str) -> str:
+    """Экранирует текст сообщения; переводы строк становятся <br>, как в экспорте Telegram."""
+    if NEEDS_ESCAPE.search(text):
+        text = escape(text)
+    return text.replace("\n", "<br>")
+
+
+def render_media(media: dict) -> str:
+    """Возвращает фрагмент вложения; пути к файлам — относительно страницы чата."""
+    title = media["name"] or media["kind"]
+    if media["status"] == "pending":
+        return MEDIA_SKIPPED.render(title=title, status="Not downloaded yet")
+    if media["status"] != "stored":
+        return MEDIA_SKIPPED.render(title=title, status="Not included, media size limit exceeded")
+
+    href = f"{MEDIA_HREF_PREFIX}{media['path']}"
+    if media["kind"] == "photo":
+        return MEDIA_PHOTO.render(href=href)
+    return MEDIA_FILE.render(href=href, title=title, size=format_size(media["size"]))
+
+
+def render_message(message_data: dict) -> str:
+    """Возвращает фрагмент одного сообщения.
+
+    Фрагмент обрамляется комментариями <!--m{id}--> и <!--/m{id}-->, по
+    которым сообщение заменяется при правке без разбора страницы. Если в
+    message_data есть versions (правки по порядку), показывается текст
+    последней версии, а предыдущие — в сворачиваемой истории. Вложения из
+    media показываются как в экспорте Telegram: фото — картинкой, прочие
+    файлы — ссылкой. Текст из старой разметки передается в text_html и не
+    экранируется повторно.
+    """
+    versions = message_data.get("versions")
+    deleted_at = message_data.get("deleted_at")
+    original_html = message_data.get("text_html") or text_html(message_data["text"])
+
+    media = message_data.get("media")
+    extra = ""
+    if versions:
+        extra = EDIT_HISTORY_HEAD.render(edit_date=versions[-1]["edit_date"])
+        extra += EDIT_HISTORY_VERSION.render(edit_date=message_data["timestamp"], text_html=original_html)
+        for version in versions[:-1]:
+            extra += EDIT_HISTORY_VERSION.render(edit_date=version["edit_date"], text_html=text_html(version["text"]))
+        extra += EDIT_HISTORY_TAIL.source
+    if deleted_at:
+        extra += DELETED_NOTE.render(deleted_at=deleted_at)
+
+    return MESSAGE.render(
+        id=message_data["id"],
+        classes="message default clearfix deleted" if deleted_at else "message default clearfix",
+        initial=message_data["initial"],
+        timestamp=message_data["timestamp"],
+        time=message_data["time"],
+        sender_name=message_data["sender_name"],
+        media_html="".join(render_media(item) for item in media) if media else "",
+        text_html=text_html(versions[-1]["text"]) if versions else original_html,
+        extra_html=extra,
+    )
+
+
+def write_message(write: Write, message_data: dict) -> None:
+    """Записывает фрагмент одного сообщения через write (см. render_message)."""
+    write(render_message(message_data))
+
+
+def write_page(write: Write, name: str, initial: str, messages: list, previous_href: Optional[str] = None) -> None:
+    """Записывает страницу чата с сообщениями и маркером конца истории.
+
+    Args:
+        write (Write): Функция записи.
+        name (str): Имя чата для заголовка страницы.
+        initial (str): Инициал для аватара.
+        messages (list): Сообщения страницы.
+        previous_href (Optional[str]): Ссылка на предыдущую страницу, если она есть.
+    """
+    PAGE_HEADER.write(write, name=name)
+    if previous_href:
+        PREVIOUS_LINK.write(write, href=previous_href)
+    for msg in messages:
+        write_message(write, {**msg, "initial": initial})
+    PAGE_FOOTER.write(write)
+
+
+def chat_entry_tag(name: str, initial: str, href: str, messages_count: int, chat_type: str = "private",
+                   peer_id: Optional[int] = None) -> Tag:
+    """Возвращает тег записи чата для chats.html, скопированный с заранее разобранного шаблона."""
+    entry = copy.copy(CHAT_ENTRY)
+    entry["href"] = href
+    if peer_id is not None:
+        entry["data-peer-id"] = str(peer_id)
+    entry.find("div", class_="initials").string = initial
+    entry.find("div", class_="info").string = chat_type
+    entry.find("div", class_="name").string = name
+    entry.find("div", class_="details_entry").string = f"{messages_count} messages"
+    return entry
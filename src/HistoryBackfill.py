@@ -0,0 +1,105 @@
+# HistoryBackfill.py
+# Загрузка истории диалогов с возобновлением с последнего загруженного сообщения.
+import asyncio
+from typing import Any, Optional
+
+from SenderCache import SenderInfo
+
+
+class HistoryBackfill:
+    """Класс для пакетной загрузки истории диалогов в архив.
+
+    Для каждого диалога хранится id последнего загруженного сообщения
+    (high-water mark) в той же транзакции, что и сами сообщения, поэтому
+    после перезапуска загрузка продолжается с места остановки и догоняет
+    сообщения, пропущенные пока трекер не работал.
+    """
+
+    def __init__(self, client: Any, handler: Any, batch_size: int = 500):
+        """Инициализация загрузки.
+
+        Args:
+            client (Any): Клиент с интерфейсом TelegramClient (iter_dialogs, iter_messages).
+            handler (Any): MessageHandler, через хранилище и менеджер HTML которого пишется история.
+            batch_size (int): Число сообщений в одной транзакции и одной отрисовке.
+        """
+        self.client = client
+        self.handler = handler
+        self.batch_size = batch_size
+
+    async def run(self) -> dict[int, int]:
+        """Загружает новые сообщения всех диалогов.
+
+        Returns:
+            dict[int, int]: chat id -> число загруженных сообщений.
+        """
+        loaded = {}
+        async for dialog in self.client.iter_dialogs():
+            try:
+                loaded[dialog.id] = await self.backfill_dialog(dialog)
+            except Exception as e:
+                print(f"[Backfill Error] {getattr(dialog, 'name', dialog.id)}: {e}")
+        return loaded
+
+    async def backfill_dialog(self, dialog: Any) -> int:
+        """Загружает сообщения диалога новее сохраненной отметки пачками по batch_size.
+
+        Returns:
+            int: Число загруженных сообщений.
+        """
+        store = self.handler.event_store
+        min_id = store.get_backfill_mark(dialog.id)
+        batch: list[dict] = []
+        media: list[tuple[Any, int]] = []
+        last_id = min_id
+        loaded = 0
+        async for message in self.client.iter_messages(dialog.entity, min_id=min_id, reverse=True):
+            last_id = max(last_id, message.id)
+            record = self._build_record(message, dialog.id)
+            if record is not None:
+                batch.append(record)
+                if message.media and self.handler.media_downloader is not None:
+                    media.append((message, record["peer_id"]))
+            if len(batch) >= self.batch_size:
+                loaded += await asyncio.to_thread(self._write_batch, dialog.id, batch, last_id)
+                await self._enqueue_media(dialog.id, media)
+                batch, media = [], []
+        if last_id > min_id:
+            loaded += await asyncio.to_thread(self._write_batch, dialog.id, batch, last_id)
+            await self._enqueue_media(dialog.id, media)
+        return loaded
+
+    async def _enqueue_media(self, chat_id: int, media: list[tuple[Any, int]]) -> None:
+        """Ставит в очередь вложения пачки.
+
+        Вызывается после записи и отрисовки пачки: вложение, скачанное
+        раньше своего сообщения, некуда было бы вставить на странице.
+        """
+        for message, peer_id in media:
+            await self.handler.media_downloader.enqueue(message, peer_id, chat_id)
+
+    def _build_record(self, message: Any, chat_id: int) -> Optional[dict]:
+        """Строит запись сообщения; служебные сообщения и сообщения без отправителя пропускаются."""
+        sender = getattr(message, "sender", None)
+        if sender is None or getattr(message, "action", None) is not None:
+            return None
+        info = SenderInfo.from_entity(sender)
+        self.handler.sender_cache.put(sender.id, info)
+        return self.handler.buildMessageRecord(message, sender.id, info, chat_id)
+
+    def _write_batch(self, chat_id: int, batch: list[dict], last_id: int) -> int:
+        """Записывает пачку и отметку одной транзакцией и отрисовывает затронутые чаты.
+
+        Вызывается в отдельном потоке, чтобы не блокировать цикл событий.
+
+        Returns:
+            int: Число записанных сообщений.
+        """
+        store = self.handler.event_store
+        for record in batch:
+            store.record_user(record["peer_id"], record["display_name"], record["sender_name"], record["initial"])
+            store.record_message(record["peer_id"], record["message"])
+        store.set_backfill_mark(chat_id, last_id)
+        store.commit()
+        self.handler.chat_manager.render_pending(store)
+        return len(batch)
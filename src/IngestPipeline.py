@@ -0,0 +1,112 @@
+# IngestPipeline.py
+# Конвейер обработки входящих записей вне цикла событий asyncio.
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+class IngestPipeline:
+    """Класс для обработки записей в пуле потоков с сохранением порядка внутри чата.
+
+    Записи распределяются по ограниченным очередям по ключу чата: записи
+    одного чата всегда попадают в одну очередь и обрабатываются по порядку,
+    а разные очереди обрабатываются параллельно. Один конвейер может
+    обслуживать несколько аккаунтов: функция обработки передается с записью.
+    """
+
+    def __init__(self, process: Optional[Callable[[dict], None]] = None, workers: int = 4, max_queue: int = 1000):
+        """Инициализация конвейера.
+
+        Args:
+            process (Optional[Callable[[dict], None]]): Синхронная функция обработки одной записи
+                по умолчанию (если в submit не передана своя).
+            workers (int): Число параллельных обработчиков.
+            max_queue (int): Суммарная емкость очередей; при заполнении submit ждет.
+        """
+        self.process = process
+        self.workers = workers
+        self._queues = [asyncio.Queue(maxsize=max(1, max_queue // workers)) for _ in range(workers)]
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tasks: list[asyncio.Task] = []
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.backpressure_waits = 0
+        self.backpressure_seconds = 0.0
+
+    async def start(self) -> None:
+        """Запускает обработчики очередей."""
+        if self._tasks:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ingest")
+        self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+
+    async def submit(self, record: dict, key: Any, process: Optional[Callable[[dict], None]] = None) -> None:
+        """Ставит запись в очередь чата. Если очередь заполнена, ждет освобождения места.
+
+        Args:
+            record (dict): Нормализованная запись события.
+            key (Any): Ключ чата, определяющий порядок обработки.
+            process (Optional[Callable[[dict], None]]): Функция обработки записи (по умолчанию — из конструктора).
+        """
+        item = (process or self.process, record)
+        queue = self._queues[hash(key) % self.workers]
+        if queue.full():
+            self.backpressure_waits += 1
+            started = time.monotonic()
+            await queue.put(item)
+            self.backpressure_seconds += time.monotonic() - started
+        else:
+            queue.put_nowait(item)
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, self.queue_depth())
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        """Последовательно обрабатывает записи одной очереди в пуле потоков."""
+        loop = asyncio.get_running_loop()
+        while True:
+            process, record = await queue.get()
+            try:
+                await loop.run_in_executor(self._executor, process, record)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"[Ingest Error]: {e}")
+            finally:
+                queue.task_done()
+
+    async def join(self) -> None:
+        """Ждет обработки всех поставленных в очередь записей."""
+        for queue in self._queues:
+            await queue.join()
+
+    async def stop(self) -> None:
+        """Дожидается опустошения очередей и останавливает обработчики."""
+        if not self._tasks:
+            return
+        await self.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def queue_depth(self) -> int:
+        """Возвращает суммарное число записей, ожидающих обработки."""
+        return sum(queue.qsize() for queue in self._queues)
+
+    def metrics(self) -> dict[str, float]:
+        """Возвращает счетчики конвейера: глубину очередей и ожидания из-за backpressure."""
+        return {
+            "queue_depth": self.queue_depth(),
+            "queue_max_depth": self.max_depth,
+            "queue_capacity": sum(queue.maxsize for queue in self._queues),
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "failed": self.failed,
+            "backpressure_waits": self.backpressure_waits,
+            "backpressure_seconds": round(self.backpressure_seconds, 6),
+        }
@@ -0,0 +1,183 @@
+# Journal.py
+# Журнал упреждающей записи (JSON Lines) с групповым fsync.
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+from Metrics import metrics
+
+# Размер журнала, после которого при очередном коммите из него убираются учтенные записи.
+CHECKPOINT_BYTES = 1024 * 1024
+
+
+class Journal:
+    """Класс для последовательного журнала событий и операций над страницами.
+
+    Каждая запись получает возрастающий номер seq и дописывается строкой JSON.
+    wait_durable(seq) возвращается, когда запись гарантированно на диске:
+    первый ожидающий поток ждет sync_window секунд, собирая записи других
+    потоков, и выполняет один fsync на всю группу. Если других непримененных
+    событий нет, fsync выполняется сразу.
+
+    Номера записей событий, которые еще не применены к хранилищу, хранятся
+    в памяти; applied_watermark — наибольший seq, до которого включительно
+    все события применены.
+    """
+
+    def __init__(self, path: Path, sync_window: float = 0.005, start_seq: int = 0):
+        """Открывает журнал на дозапись.
+
+        Args:
+            path (Path): Путь к файлу журнала.
+            sync_window (float): Сколько секунд копить записи перед групповым fsync.
+            start_seq (int): Последний seq, уже известный хранилищу; нумерация продолжается с большего
+                из него и последнего seq в файле.
+        """
+        self.path = path
+        self.sync_window = sync_window
+        last_seq = max([start_seq] + [record["seq"] for record in self.read(path)])
+        self._file = path.open("ab")
+        self._lock = threading.Lock()
+        self._synced = threading.Condition(self._lock)
+        self._syncing = False
+        self._last_seq = last_seq
+        self._synced_seq = last_seq
+        self._pending: set[int] = set()
+
+    @staticmethod
+    def read(path: Path) -> list[dict]:
+        """Читает записи журнала; оборванная при сбое последняя строка пропускается."""
+        if not path.exists():
+            return []
+        records = []
+        with path.open("rb") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+        return records
+
+    def append(self, record: dict, pending: bool = False) -> int:
+        """Дописывает запись в журнал (без fsync).
+
+        Args:
+            record (dict): Запись; поле seq добавляется журналом.
+            pending (bool): Запись события, которое нужно отметить через mark_applied.
+
+        Returns:
+            int: Номер записи.
+        """
+        with self._lock:
+            self._last_seq += 1
+            seq = self._last_seq
+            line = json.dumps({**record, "seq": seq}, ensure_ascii=False).encode("utf-8") + b"\n"
+            self._file.write(line)
+            self._file.flush()
+            if pending:
+                self._pending.add(seq)
+        metrics.inc("journal_bytes_total", len(line))
+        return seq
+
+    def wait_durable(self, seq: int) -> None:
+        """Дожидается fsync записи seq; fsync выполняется один раз на группу записей."""
+        with self._lock:
+            while self._synced_seq < seq:
+                if self._syncing:
+                    self._synced.wait()
+                    continue
+                self._syncing = True
+                # Ждать других потоков имеет смысл, только если есть другие непримененные события.
+                gather = self.sync_window and len(self._pending) > 1
+                self._lock.release()
+                try:
+                    if gather:
+                        time.sleep(self.sync_window)
+                    with self._lock:
+                        target = self._last_seq
+                        self._file.flush()
+                        fd = self._file.fileno()
+                    with metrics.time("journal_fsync"):
+                        os.fsync(fd)
+                finally:
+                    self._lock.acquire()
+                    self._syncing = False
+                    self._synced.notify_all()
+                self._synced_seq = max(self._synced_seq, target)
+                metrics.inc("journal_fsyncs_total")
+
+    def sync(self) -> None:
+        """Дожидается fsync всех уже записанных записей."""
+        with self._lock:
+            seq = self._last_seq
+        self.wait_durable(seq)
+
+    @property
+    def last_seq(self) -> int:
+        """Номер последней записанной записи."""
+        with self._lock:
+            return self._last_seq
+
+    def mark_applied(self, seq: int) -> int:
+        """Отмечает событие seq примененным к хранилищу.
+
+        Returns:
+            int: Текущий applied_watermark.
+        """
+        with self._lock:
+            self._pending.discard(seq)
+            return self._watermark()
+
+    def _watermark(self) -> int:
+        return min(self._pending) - 1 if self._pending else self._last_seq
+
+    @property
+    def applied_watermark(self) -> int:
+        """Наибольший seq, до которого все события применены к хранилищу."""
+        with self._lock:
+            return self._watermark()
+
+    def compact(self, keep: Callable[[dict], bool]) -> int:
+        """Переписывает журнал, оставляя только нужные записи (контрольная точка).
+
+        Новые записи во время переписывания ждут на блокировке.
+
+        Args:
+            keep (Callable[[dict], bool]): Возвращает True для записей, которые еще нужны для восстановления.
+
+        Returns:
+            int: Число оставшихся записей.
+        """
+        with self._lock:
+            while self._syncing:
+                self._synced.wait()
+            self._file.flush()
+            records = [record for record in self.read(self.path) if keep(record)]
+            if not records and self._file.tell() == 0:
+                return 0
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with tmp_path.open("wb") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp_path, self.path)
+            self._file = self.path.open("ab")
+            self._synced_seq = self._last_seq
+            return len(records)
+
+    def size(self) -> int:
+        """Возвращает размер журнала в байтах."""
+        with self._lock:
+            return self._file.tell()
+
+    def close(self) -> None:
+        """Сбрасывает журнал на диск и закрывает его."""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
@@ -0,0 +1,242 @@
+# MediaDownloader.py
+# Скачивание вложений отдельно от записи текста, с дедупликацией по хэшу содержимого.
+import asyncio
+import hashlib
+import os
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+
+from EventStore import EventStore
+
+# Размер блока при подсчете хэша файла.
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: Path) -> str:
+    """Считает SHA-256 файла блоками."""
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaDownloader:
+    """Класс для скачивания вложений пулом asyncio-задач.
+
+    Файлы хранятся в media/<xx>/<sha256><ext>, поэтому пересланные и
+    повторно отправленные вложения не занимают места повторно. Объем ограничен
+    бюджетом на чат (по всем вложениям чата) и общим бюджетом (по уникальным
+    файлам); 0 означает отсутствие ограничения.
+
+    Вложение, не поместившееся в очередь, записывается в хранилище со
+    статусом pending и скачивается retry_pending, когда очередь освободится,
+    или при следующем запуске.
+    """
+
+    def __init__(self, client: Any, store: EventStore, media_dir: Path,
+                 on_stored: Callable[[dict], Awaitable[None]], workers: int = 4, max_queue: int = 1000,
+                 chat_budget: int = 0, global_budget: int = 0):
+        """Инициализация загрузчика.
+
+        Args:
+            client (Any): Клиент с методом download_media.
+            store (EventStore): Хранилище, из которого берется уже занятый объем.
+            media_dir (Path): Каталог для файлов.
+            on_stored (Callable[[dict], Awaitable[None]]): Корутина, получающая запись о вложении.
+            workers (int): Число одновременных загрузок.
+            max_queue (int): Емкость очереди; при переполнении вложение откладывается, а не ждет.
+            chat_budget (int): Максимум байт вложений на один чат.
+            global_budget (int): Максимум байт всех уникальных файлов.
+        """
+        self.client = client
+        self.store = store
+        self.media_dir = media_dir
+        self.on_stored = on_stored
+        self.workers = workers
+        self.chat_budget = chat_budget
+        self.global_budget = global_budget
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._tasks: list[asyncio.Task] = []
+        self._retry_task: Optional[asyncio.Task] = None
+        self._retry_due = False
+        self._chat_bytes: dict[int, int] = {}
+        self._global_bytes = 0
+        self.downloaded = 0
+        self.deduplicated = 0
+        self.skipped = 0
+        self.failed = 0
+        self.deferred = 0
+        self.bytes_written = 0
+
+    async def start(self) -> None:
+        """Запускает задачи загрузки."""
+        if self._tasks:
+            return
+        (self.media_dir / ".tmp").mkdir(parents=True, exist_ok=True)
+        self._global_bytes = self.store.media_bytes()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def submit(self, message: Any, peer_id: int, chat_id: int) -> bool:
+        """Ставит вложение сообщения в очередь, не дожидаясь места в ней.
+
+        Returns:
+            bool: False, если очередь заполнена и вложение отложено (статус pending).
+        """
+        try:
+            self._queue.put_nowait((message, peer_id, chat_id))
+            return True
+        except asyncio.QueueFull:
+            self.deferred += 1
+            self._retry_due = True
+            await self.on_stored(self._record(message, peer_id, chat_id, "pending"))
+            return False
+
+    async def enqueue(self, message: Any, peer_id: int, chat_id: int) -> None:
+        """Ставит вложение в очередь, дожидаясь места (для загрузки истории)."""
+        await self._queue.put((message, peer_id, chat_id))
+
+    async def retry_pending(self) -> int:
+        """Ставит в очередь отложенные вложения, заново получая их сообщения у клиента.
+
+        Вложение, сообщение которого удалено или уже без вложения, закрывается
+        как пропущенное.
+
+        Returns:
+            int: Число поставленных в очередь вложений.
+        """
+        queued = 0
+        for row in await asyncio.to_thread(self.store.pending_media):
+            try:
+                message = await self.client.get_messages(row["chat_id"], ids=row["message_id"])
+            except Exception as e:
+                self.failed += 1
+                print(f"[Media Error] message {row['message_id']}: {e}")
+                continue
+            if message is None or not message.media:
+                await self.on_stored({"kind": "media", "peer_id": row["peer_id"], "chat_id": row["chat_id"],
+                                      "message_id": row["message_id"], "media_kind": row["kind"], "name": row["name"],
+                                      "mime": row["mime"], "size": row["size"], "sha256": None, "path": None,
+                                      "status": "skipped"})
+                continue
+            await self._queue.put((message, row["peer_id"], row["chat_id"]))
+            queued += 1
+        return queued
+
+    async def _worker(self) -> None:
+        """Скачивает вложения из очереди; после переполнения, когда очередь опустеет, запускает retry_pending."""
+        while True:
+            message, peer_id, chat_id = await self._queue.get()
+            try:
+                await self.on_stored(await self._download(message, peer_id, chat_id))
+            except Exception as e:
+                self.failed += 1
+                print(f"[Media Error] message {message.id}: {e}")
+            finally:
+                self._queue.task_done()
+            if self._retry_due and self._queue.empty():
+                self.start_retry()
+
+    def start_retry(self) -> None:
+        """Запускает retry_pending в фоне, если он еще не идет."""
+        if self._retry_task is None or self._retry_task.done():
+            self._retry_due = False
+            self._retry_task = asyncio.create_task(self.retry_pending())
+
+    def _chat_used(self, peer_id: int) -> int:
+        """Возвращает объем вложений чата, загружая его из хранилища при первом обращении."""
+        if peer_id not in self._chat_bytes:
+            self._chat_bytes[peer_id] = self.store.media_bytes(peer_id)
+        return self._chat_bytes[peer_id]
+
+    @staticmethod
+    def _record(message: Any, peer_id: int, chat_id: int, status: str) -> dict:
+        """Возвращает запись о вложении сообщения без файла."""
+        file = message.file
+        return {
+            "kind": "media",
+            "peer_id": peer_id,
+            "chat_id": chat_id,
+            "message_id": message.id,
+            "media_kind": "photo" if getattr(message, "photo", None) else "file",
+            "name": getattr(file, "name", None),
+            "mime": getattr(file, "mime_type", None),
+            "size": getattr(file, "size", None) or 0,
+            "sha256": None,
+            "path": None,
+            "status": status,
+        }
+
+    async def _download(self, message: Any, peer_id: int, chat_id: int) -> dict:
+        """Скачивает одно вложение и возвращает запись о нем."""
+        file = message.file
+        record = self._record(message, peer_id, chat_id, "skipped")
+        # Объем резервируется до загрузки, чтобы параллельные загрузки одного чата не превысили бюджет.
+        reserved = record["size"]
+        if self.chat_budget and self._chat_used(peer_id) + reserved > self.chat_budget:
+            self.skipped += 1
+            return record
+        self._chat_bytes[peer_id] = self._chat_used(peer_id) + reserved
+
+        stored = False
+        tmp_path = self.media_dir / ".tmp" / f"{chat_id}_{message.id}"
+        try:
+            downloaded = await self.client.download_media(message, file=str(tmp_path))
+            if downloaded is None:
+                raise ValueError("вложение не скачано")
+            tmp_path = Path(downloaded)
+            sha256 = await asyncio.to_thread(file_sha256, tmp_path)
+            size = tmp_path.stat().st_size
+            ext = getattr(file, "ext", None) or tmp_path.suffix
+            target = self.media_dir / sha256[:2] / f"{sha256}{ext}"
+            if target.exists():
+                self.deduplicated += 1
+            elif self.global_budget and self._global_bytes + size > self.global_budget:
+                self.skipped += 1
+                record["size"] = size
+                return record
+            else:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, target)
+                self._global_bytes += size
+                self.bytes_written += size
+                self.downloaded += 1
+            stored = True
+        finally:
+            tmp_path.unlink(missing_ok=True)
+            self._chat_bytes[peer_id] -= reserved
+            if stored:
+                self._chat_bytes[peer_id] += size
+
+        record.update(sha256=sha256, size=size, path=target.relative_to(self.media_dir).as_posix(), status="stored")
+        return record
+
+    async def stop(self) -> None:
+        """Дожидается загрузки очереди и останавливает задачи.
+
+        Незавершенный retry_pending отменяется: оставшиеся вложения остаются
+        отложенными до следующего запуска.
+        """
+        if not self._tasks:
+            return
+        if self._retry_task is not None:
+            self._retry_task.cancel()
+            await asyncio.gather(self._retry_task, return_exceptions=True)
+        await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def metrics(self) -> dict[str, float]:
+        """Возвращает счетчики загрузчика."""
+        return {
+            "media_queue_depth": self._queue.qsize(),
+            "media_downloaded": self.downloaded,
+            "media_deduplicated": self.deduplicated,
+            "media_skipped": self.skipped,
+            "media_deferred": self.deferred,
+            "media_failed": self.failed,
+            "media_bytes_written": self.bytes_written,
+            "media_bytes_total": self._global_bytes,
+        }
@@ -1,72 +1,291 @@
 from telethon.tl.types import Message
-from typing import Any
+from typing import Any, Optional
 from pathlib import Path
 from ChatHTMLManager import ChatHTMLManager
-from datetime import timedelta
+from EventStore import EventStore
+from IngestPipeline import IngestPipeline
+from Journal import CHECKPOINT_BYTES, Journal
+from MediaDownloader import MediaDownloader
+from Metrics import metrics
+from SenderCache import SenderCache, SenderInfo
+from Сonfig import AccountConfig, Config
+from datetime import datetime, timedelta, timezone
 
-def find_chats_html() -> Path:
-    """Ищет файл chats.html по шаблону DataExport*/lists/chats.html."""
+# Виды записей журнала, которые являются событиями (остальные — операции над страницами).
+EVENT_KINDS = ("message", "edit", "delete", "media")
+
+def find_chats_html(export_dir: Optional[str] = None) -> Path:
+    """Возвращает chats.html каталога экспорта или ищет его по шаблону DataExport*/lists/chats.html."""
+    if export_dir:
+        html_path = Path(export_dir) / "lists" / "chats.html"
+        if not html_path.exists():
+            raise FileNotFoundError(f"Файл chats.html не найден в {export_dir}")
+        return html_path
     matches = list(Path(".").glob("DataExport*/lists/chats.html"))
     if not matches:
         raise FileNotFoundError("Файл chats.html не найден по шаблону DataExport*/lists/chats.html")
     return matches[0]
 
 class MessageHandler:
-    """Класс для обработки входящих сообщений."""
-    chat_manager = ChatHTMLManager(find_chats_html())
+    """Класс для обработки входящих сообщений одного аккаунта.
+
+    Обработчики Telethon только нормализуют событие в запись и передают ее в
+    IngestPipeline; блокирующая запись в EventStore и перерисовка HTML после
+    коммита пакетной транзакции выполняются в пуле потоков. Конвейер может
+    быть общим для нескольких аккаунтов (см. usePipeline): у каждого аккаунта
+    свой архив, а пул потоков и метрики — одни на процесс.
+
+    Если журнал включен, запись события сначала дописывается в journal.jsonl,
+    и обработчик конвейера применяет ее после группового fsync. После
+    некорректной остановки конструктор откатывает недописанные страницы и
+    повторяет события журнала, не попавшие в закоммиченную транзакцию.
+    """
+
+    def __init__(self, config: Config, account: Optional[AccountConfig] = None):
+        """Открывает архив аккаунта и применяет настройки: пакетную запись событий,
+        отложенную запись chats.html, размер страниц и кэш отправителей.
+
+        Args:
+            config (Config): Общие настройки.
+            account (Optional[AccountConfig]): Сессия и каталог экспорта аккаунта; по умолчанию
+                EXPORT_DIR (или DataExport* в текущем каталоге).
+        """
+        self.name = account.session_name if account else "default"
+        export_dir = account.export_dir if account else config.export_dir
+        chat_manager = ChatHTMLManager(find_chats_html(export_dir), config.flush_interval, config.flush_every, config.page_size)
+        self.chat_manager = chat_manager
+        self.event_store = EventStore(chat_manager.html_path.parent.parent / "archive.sqlite")
+        self.event_store.configure_batching(config.flush_interval, config.flush_every)
+        self.sender_cache = SenderCache(config.sender_cache_size, config.sender_cache_ttl)
+        self.pipeline: Optional[IngestPipeline] = None
+        self.media_downloader: Optional[MediaDownloader] = None
+        metrics.enabled = config.metrics_enabled
+        self.journal: Optional[Journal] = None
+        if config.journal_enabled:
+            self._openJournal(chat_manager.html_path.parent.parent / "journal.jsonl", config.journal_sync_window)
+
+    def _openJournal(self, path: Path, sync_window: float) -> None:
+        """Открывает журнал и восстанавливает архив по записям, оставшимся после некорректной остановки."""
+        store = self.event_store
+        applied = store.get_journal_mark("applied")
+        rendered = store.get_journal_mark("rendered")
+        records = Journal.read(path)
+        journal = Journal(path, sync_window, start_seq=max(applied, rendered))
+        self.journal = journal
+        self.chat_manager.journal = journal
+        if not records:
+            return
+
+        undone = self.chat_manager.recover(records, rendered)
+        replayed = 0
+        for record in records:
+            if record["kind"] in EVENT_KINDS and record["seq"] > applied:
+                try:
+                    self._applyRecord(record)
+                    replayed += 1
+                except Exception as e:
+                    print(f"[Journal Replay Error on {record['kind']}]: {e}")
+        store.set_journal_mark("applied", journal.applied_watermark)
+        self.flush()
+        print(f"Журнал {self.name}: повторено событий {replayed}, откачено изменений страниц {undone}")
+
+    def enablePipeline(self, workers: int, max_queue: int) -> IngestPipeline:
+        """Включает обработку записей в собственном пуле потоков вместо цикла событий.
+
+        Args:
+            workers (int): Число параллельных обработчиков.
+            max_queue (int): Емкость очереди записей.
+
+        Returns:
+            IngestPipeline: Конвейер; его нужно запустить через start().
+        """
+        return self.usePipeline(IngestPipeline(self.processRecord, workers, max_queue))
+
+    def usePipeline(self, pipeline: IngestPipeline) -> IngestPipeline:
+        """Передает записи в конвейер, общий с другими аккаунтами; порядок сохраняется внутри чата аккаунта.
+
+        Returns:
+            IngestPipeline: Тот же конвейер.
+        """
+        self.pipeline = pipeline
+        return pipeline
+
+    def enableMedia(self, client: Any, config: Config) -> MediaDownloader:
+        """Включает скачивание вложений; записи о них проходят через тот же конвейер, что и сообщения.
+
+        Returns:
+            MediaDownloader: Загрузчик; его нужно запустить через start().
+        """
+        self.media_downloader = MediaDownloader(
+            client,
+            self.event_store,
+            self.chat_manager.html_path.parent.parent / "media",
+            self._submit,
+            workers=config.media_workers,
+            chat_budget=config.media_chat_budget,
+            global_budget=config.media_global_budget,
+        )
+        return self.media_downloader
+
+    def enableMetrics(self) -> None:
+        """Подключает к общим метрикам счетчики загрузчика и кэша отправителей с меткой account.
+
+        Счетчики конвейера и HTTP-эндпоинт общие для процесса и подключаются в main.py.
+        """
+        if self.media_downloader is not None:
+            metrics.add_source(self.media_downloader.metrics, account=self.name)
+        metrics.add_source(lambda: {
+            "sender_cache_size": len(self.sender_cache),
+            "sender_cache_hits": self.sender_cache.hits,
+            "sender_cache_misses": self.sender_cache.misses,
+        }, account=self.name)
+
+    def flushIfDue(self) -> None:
+        """Коммитит события и перерисовывает HTML, если истек интервал записи."""
+        with metrics.time("store_commit"):
+            committed = self.event_store.commit_if_due()
+        if committed:
+            self.chat_manager.render_pending(self.event_store)
+            if self.journal is not None and self.journal.size() > CHECKPOINT_BYTES:
+                self.checkpoint()
+        self.chat_manager.flush_if_due()
+
+    def flush(self) -> None:
+        """Коммитит все события, перерисовывает HTML и сбрасывает его на диск."""
+        with metrics.time("store_commit"):
+            self.event_store.commit()
+        self.chat_manager.render_pending(self.event_store)
+        self.chat_manager.flush()
+        self.checkpoint()
+
+    def checkpoint(self) -> None:
+        """Убирает из журнала записи, которые уже закоммичены в хранилище и отражены в chats.html."""
+        journal = self.journal
+        if journal is None:
+            return
+        marks = self.event_store.commit_journal_marks()
+        applied = marks.get("applied", 0)
+        settled = min(marks.get("rendered", 0), self.chat_manager.flushed_seq)
+        with metrics.time("journal_checkpoint"):
+            journal.compact(lambda record: record["seq"] > (applied if record["kind"] in EVENT_KINDS else settled))
+
+    async def _resolveSender(self, event: Any) -> Optional[tuple[int, SenderInfo]]:
+        """Возвращает id и данные отправителя, по возможности без запроса к Telegram.
+
+        Сначала используется сущность, пришедшая вместе с обновлением, затем
+        кэш по sender id, и только потом event.get_sender().
+        """
+        sender = event.sender
+        if sender is not None and not getattr(sender, "min", False):
+            metrics.inc("sender_lookups_total", source="event")
+            info = SenderInfo.from_entity(sender)
+            self.sender_cache.put(sender.id, info)
+            return sender.id, info
+
+        sender_id = event.sender_id
+        if sender_id is not None:
+            info = self.sender_cache.get(sender_id)
+            if info is not None:
+                metrics.inc("sender_lookups_total", source="cache")
+                return sender_id, info
+
+        metrics.inc("sender_lookups_total", source="get_sender")
+        with metrics.time("get_sender"):
+            sender = await event.get_sender()
+        if not sender:
+            return None
+        info = SenderInfo.from_entity(sender)
+        self.sender_cache.put(sender.id, info)
+        return sender.id, info
+
+    async def handleUserNameUpdate(self, event: Any) -> None:
+        """Сбрасывает кэш отправителя, сменившего имя или username."""
+        self.sender_cache.invalidate(event.user_id)
+
+    async def _submit(self, record: dict) -> None:
+        """Передает запись в конвейер обработки или обрабатывает ее сразу, если конвейера нет."""
+        if self.journal is not None:
+            record["seq"] = self.journal.append(record, pending=True)
+        if self.pipeline is not None:
+            await self.pipeline.submit(record, (self.name, record["peer_id"]), self.processRecord)
+        else:
+            self.processRecord(record)
+
+    def processRecord(self, record: dict) -> None:
+        """Записывает нормализованную запись события в хранилище (выполняется вне цикла событий).
+
+        Запись из журнала применяется только после fsync журнала; отметка
+        applied в хранилище сдвигается в той же транзакции.
+        """
+        store = self.event_store
+        journal = self.journal
+        seq = record.get("seq")
+        metrics.inc("events_total", kind=record["kind"])
+        try:
+            if journal is not None and seq is not None:
+                journal.wait_durable(seq)
+            self._applyRecord(record)
+        except Exception as e:
+            metrics.inc("errors_total", kind=record["kind"])
+            print(f"[HTML Sync Error on {record['kind']}]: {e}")
+        finally:
+            # Сбойная запись тоже считается примененной, иначе она повторялась бы при каждом запуске.
+            if journal is not None and seq is not None:
+                store.set_journal_mark("applied", journal.mark_applied(seq))
+        try:
+            self.flushIfDue()
+        except Exception as e:
+            metrics.inc("errors_total", kind="flush")
+            print(f"[HTML Sync Error on {record['kind']}]: {e}")
+
+    def _applyRecord(self, record: dict) -> None:
+        """Применяет запись события к хранилищу; повторное применение ничего не меняет."""
+        store = self.event_store
+        with metrics.time("store_write"):
+            if record["kind"] == "delete":
+                for message_id in record["message_ids"]:
+                    store.record_deletion(record["chat_id"], message_id, record["deleted_at"])
+            elif record["kind"] == "media":
+                store.record_media(record["peer_id"], record.get("chat_id"), record["message_id"], record)
+            else:
+                store.record_user(record["peer_id"], record["display_name"], record["sender_name"], record["initial"])
+                if record["kind"] == "message":
+                    store.record_message(record["peer_id"], record["message"])
+                elif record["kind"] == "edit":
+                    store.record_edit(record["peer_id"], record.get("chat_id"), record["message_id"], record["text"], record["edit_date"])
 
     @staticmethod
-    async def handleMessage(event: Any) -> None:
-        """Обрабатывает входящее сообщение и синхронизирует с HTML."""
+    def buildMessageRecord(message: Message, peer_id: int, sender: SenderInfo, chat_id: Optional[int]) -> dict:
+        """Нормализует сообщение Telethon в запись для хранилища событий."""
+        local_time = message.date + timedelta(hours=3)
+        return {
+            "kind": "message",
+            "peer_id": peer_id,
+            "display_name": sender.display_name,
+            "sender_name": sender.sender_name,
+            "initial": sender.initial,
+            "message": {
+                "id": message.id,
+                "chat_id": chat_id,
+                "sender_name": sender.sender_name,
+                "text": message.text or "Non-text message",
+                "date": message.date.isoformat(),
+                "timestamp": local_time.strftime("%d.%m.%Y %H:%M:%S UTC+3"),
+                "time": local_time.strftime("%H:%M"),
+                "initial": sender.initial
+            }
+        }
+
+    async def handleMessage(self, event: Any) -> None:
+        """Обрабатывает входящее сообщение и передает его на сохранение."""
         message: Message = event.message
-        sender = await event.get_sender()
-        if sender:
-            first_name = getattr(sender, "first_name", "")
-            last_name = getattr(sender, "last_name", "")
-            username = getattr(sender, "username", "")
-            display_name = f"{first_name} {last_name}".strip() or "Unknown"
-            sender_name = display_name
-            if username:
-                sender_name += f" (@{username})"
-
-            try:
-                initial = display_name[0].upper()
-                local_time = message.date + timedelta(hours=3)
-
-                if not MessageHandler.chat_manager.user_exists(display_name):
-                    chat_folder = MessageHandler.chat_manager.get_next_chat_folder()
-                    chat_name = chat_folder.name
-                    href = f"../chats/{chat_name}/messages.html#allow_back"
-                    MessageHandler.chat_manager.add_user(
-                        name=display_name,
-                        initial=initial,
-                        href=href,
-                        messages_count=1
-                    )
-                    messages = [{
-                        "id": message.id,
-                        "sender_name": sender_name,
-                        "text": message.text or "Non-text message",
-                        "timestamp": local_time.strftime("%d.%m.%Y %H:%M:%S UTC+3"),
-                        "time": local_time.strftime("%H:%M"),
-                        "initial": initial
-                    }]
-                    MessageHandler.chat_manager.create_chat_messages_html(chat_folder, display_name, initial, messages)
-                else:
-                    chat_folder = MessageHandler.chat_manager.get_chat_folder_for_existing_user(display_name)
-                    current_count = MessageHandler.chat_manager.get_message_count(display_name)
-                    MessageHandler.chat_manager.update_message_count(display_name, current_count + 1)
-                    message_data = {
-                        "id": message.id,
-                        "sender_name": sender_name,
-                        "text": message.text or "Non-text message",
-                        "timestamp": local_time.strftime("%d.%m.%Y %H:%M:%S UTC+3"),
-                        "time": local_time.strftime("%H:%M"),
-                        "initial": initial
-                    }
-                    MessageHandler.chat_manager.append_message_to_chat(chat_folder, message_data)
-            except Exception as e:
-                print(f"[HTML Sync Error]: {e}")
+        resolved = await self._resolveSender(event)
+        if resolved:
+            peer_id, sender = resolved
+            sender_name = sender.sender_name
+            await self._submit(self.buildMessageRecord(message, peer_id, sender, event.chat_id))
+            if message.media and self.media_downloader is not None:
+                await self.media_downloader.submit(message, peer_id, event.chat_id)
         else:
             sender_name = "Unknown Sender"
 
@@ -75,24 +294,32 @@ class MessageHandler:
         else:
             print(f"From {sender_name}: Received a non-text message (e.g., media, sticker)")
 
-    @staticmethod
-    async def handleMessageEdited(event: Any) -> None:
-        """Обрабатывает редактирование сообщения и обновляет HTML."""
+    async def handleMessageEdited(self, event: Any) -> None:
+        """Обрабатывает редактирование сообщения и передает новую версию на сохранение."""
         message: Message = event.message
-        sender = await event.get_sender()
-        if sender:
-            first_name = getattr(sender, "first_name", "")
-            last_name = getattr(sender, "last_name", "")
-            display_name = f"{first_name} {last_name}".strip() or "Unknown"
-
-            try:
-                chat_folder = MessageHandler.chat_manager.get_chat_folder_for_existing_user(display_name)
-                edit_time = message.edit_date.strftime("%d.%m.%Y %H:%M:%S UTC+3")
-                MessageHandler.chat_manager.update_message_in_chat(
-                    chat_folder,
-                    message.id,
-                    message.text or "Non-text message",
-                    edit_time
-                )
-            except Exception as e:
-                print(f"[HTML Sync Error on edit]: {e}")
\ No newline at end of file
+        resolved = await self._resolveSender(event)
+        if resolved:
+            peer_id, sender = resolved
+            await self._submit({
+                "kind": "edit",
+                "peer_id": peer_id,
+                "display_name": sender.display_name,
+                "sender_name": sender.sender_name,
+                "initial": sender.initial,
+                "chat_id": event.chat_id,
+                "message_id": message.id,
+                "text": message.text or "Non-text message",
+                "edit_date": (message.edit_date + timedelta(hours=3)).strftime("%d.%m.%Y %H:%M:%S UTC+3")
+            })
+
+    async def handleMessageDeleted(self, event: Any) -> None:
+        """Обрабатывает удаление сообщений: сообщения остаются в архиве с пометкой."""
+        deleted_at = (datetime.now(timezone.utc) + timedelta(hours=3)).strftime("%d.%m.%Y %H:%M:%S UTC+3")
+        await self._submit({
+            "kind": "delete",
+            "peer_id": event.chat_id or 0,
+            "chat_id": event.chat_id,
+            "message_ids": list(event.deleted_ids),
+            "deleted_at": deleted_at
+        })
+        print(f"Deleted messages: {', '.join(map(str, event.deleted_ids))}")
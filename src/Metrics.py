@@ -0,0 +1,149 @@
+# Metrics.py
+# Счетчики и замеры времени по стадиям обработки, отдаваемые в формате Prometheus.
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, ContextManager, Iterator
+
+# Префикс имен метрик.
+PREFIX = "tracker"
+
+LabelKey = tuple[str, tuple[tuple[str, str], ...]]
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    """Форматирует метки Prometheus: {stage="parse"}."""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    """Класс для сбора счетчиков и длительностей стадий.
+
+    Пока сбор выключен (enabled = False), inc и time ничего не делают,
+    поэтому инструментирование не стоит ничего на горячем пути.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._counters: dict[LabelKey, float] = {}
+        self._timings: dict[str, list[float]] = {}
+        self._sources: list[tuple[Callable[[], dict[str, float]], tuple[tuple[str, str], ...]]] = []
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        """Увеличивает счетчик name (с метками) на value."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def time(self, stage: str) -> ContextManager[None]:
+        """Контекстный менеджер, замеряющий длительность стадии."""
+        if not self.enabled:
+            return nullcontext()
+        return self._timed(stage)
+
+    @contextmanager
+    def _timed(self, stage: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                timing = self._timings.setdefault(stage, [0, 0.0, 0.0])
+                timing[0] += 1
+                timing[1] += elapsed
+                timing[2] = max(timing[2], elapsed)
+
+    def add_source(self, source: Callable[[], dict[str, float]], **labels: str) -> None:
+        """Добавляет функцию, возвращающую текущие значения (например, IngestPipeline.metrics).
+
+        Метки (например, account) добавляются ко всем ее значениям, чтобы одинаковые
+        источники разных аккаунтов не смешивались.
+        """
+        self._sources.append((source, tuple(sorted(labels.items()))))
+
+    def _gauges(self) -> list[tuple[str, tuple[tuple[str, str], ...], float]]:
+        """Опрашивает источники и возвращает значения с метками, по именам."""
+        return sorted((name, labels, value) for source, labels in self._sources for name, value in source().items())
+
+    def snapshot(self) -> dict:
+        """Возвращает все метрики в виде словаря."""
+        with self._lock:
+            counters = {f"{name}{_format_labels(labels)}": value for (name, labels), value in self._counters.items()}
+            stages = {stage: {"count": count, "seconds": round(total, 6), "max_seconds": round(longest, 6)}
+                      for stage, (count, total, longest) in self._timings.items()}
+        gauges = {f"{name}{_format_labels(labels)}": value for name, labels, value in self._gauges()}
+        return {"counters": counters, "stages": stages, "gauges": gauges}
+
+    def render_prometheus(self) -> str:
+        """Возвращает метрики в текстовом формате Prometheus."""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            timings = sorted(self._timings.items())
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE {PREFIX}_{name} counter")
+                seen.add(name)
+            lines.append(f"{PREFIX}_{name}{_format_labels(labels)} {value}")
+        if timings:
+            lines.append(f"# TYPE {PREFIX}_stage_seconds summary")
+            for stage, (count, total, _) in timings:
+                lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {count}')
+                lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f"# TYPE {PREFIX}_stage_seconds_max gauge")
+            for stage, (_, _, longest) in timings:
+                lines.append(f'{PREFIX}_stage_seconds_max{{stage="{stage}"}} {longest:.6f}')
+        seen = set()
+        for name, labels, value in self._gauges():
+            if name not in seen:
+                lines.append(f"# TYPE {PREFIX}_{name} gauge")
+                seen.add(name)
+            lines.append(f"{PREFIX}_{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_stats_file(self, path: Path) -> None:
+        """Записывает снимок метрик в JSON-файл (через временный файл)."""
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(json.dumps(self.snapshot(), ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp_path.replace(path)
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Запускает HTTP-эндпоинт /metrics в фоновом потоке.
+
+        Returns:
+            ThreadingHTTPServer: Сервер; остановка через shutdown().
+        """
+        metrics = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        return server
+
+
+# Общий экземпляр, в который пишут все модули.
+metrics = Metrics()
@@ -0,0 +1,139 @@
+# SearchIndex.py
+# Поиск по архиву: запросы к полнотекстовому индексу EventStore и статический индекс для браузера.
+import json
+from itertools import groupby
+from pathlib import Path
+from typing import Any
+
+from ChatHTMLManager import atomic_write_text, page_file_name
+from EventStore import EventStore
+from HTMLRenderer import SEARCH_PAGE
+
+# Версия формата статического индекса.
+SEARCH_EXPORT_VERSION = 1
+# Сообщений в одном файле docs/N.js.
+DOCS_PER_SHARD = 1000
+# Длина текста сообщения, сохраняемого для показа в результатах.
+SNIPPET_LENGTH = 160
+# Каталог статического индекса в корне архива; страница поиска лежит рядом с chats.html.
+SEARCH_DIR_NAME = "search"
+SEARCH_PAGE_NAME = "search.html"
+
+
+def fts_query(text: str) -> str:
+    """Превращает введенный текст в запрос FTS5: все слова обязательны, последнее — по префиксу.
+
+    Слова берутся в кавычки, поэтому операторы FTS5 (AND, NEAR, *, ...) в тексте не действуют.
+    """
+    words = [f'"{word.replace(chr(34), chr(34) * 2)}"' for word in text.split()]
+    if not words:
+        raise ValueError("Пустой поисковый запрос")
+    words[-1] += " *"
+    return " ".join(words)
+
+
+def message_href(folder: str, page: int, message_id: int) -> str:
+    """Возвращает ссылку на сообщение относительно корня архива."""
+    return f"chats/{folder}/{page_file_name(page)}#message{message_id}"
+
+
+def term_shard(term: str) -> str:
+    """Возвращает имя файла слов по первым двум символам слова (hex UTF-8, как в странице поиска)."""
+    return term[:2].encode("utf-8").hex()
+
+
+def _write_if_changed(path: Path, text: str) -> bool:
+    """Записывает файл, только если его содержимое изменилось.
+
+    Returns:
+        bool: True, если файл был записан.
+    """
+    if path.exists() and path.read_bytes() == text.encode("utf-8"):
+        return False
+    atomic_write_text(path, text)
+    return True
+
+
+def _script(call: str, *args: Any) -> str:
+    """Возвращает файл шарда: вызов archiveSearch.<call>(...), чтобы страница грузила его тегом
+    <script> и с file://, где fetch недоступен."""
+    return f"archiveSearch.{call}({', '.join(json.dumps(arg, ensure_ascii=False, separators=(',', ':')) for arg in args)});\n"
+
+
+def export_search_index(store: EventStore, archive_root: Path) -> dict[str, int]:
+    """Выгружает полнотекстовый индекс в search/ архива в виде шардов для страницы lists/search.html.
+
+    terms/<hex>.js — слова с одинаковыми первыми двумя символами и rowid
+    сообщений с ними (список ключей — в manifest.js, чтобы страница нашла
+    все шарды для префикса из одного символа); docs/<N>.js — данные
+    сообщений для показа. Файлы с неизменившимся содержимым не
+    перезаписываются, лишние удаляются. Сообщения и слова читаются из базы
+    потоком, поэтому память не растет с размером архива.
+
+    Args:
+        store (EventStore): Хранилище с индексом.
+        archive_root (Path): Корень архива (каталог с lists/ и chats/).
+
+    Returns:
+        dict[str, int]: Число сообщений, слов, записанных, неизменных и удаленных файлов.
+    """
+    if not store.search_enabled:
+        raise RuntimeError("❌ SQLite собран без FTS5, поиск недоступен")
+    search_dir = archive_root / SEARCH_DIR_NAME
+    (search_dir / "terms").mkdir(parents=True, exist_ok=True)
+    (search_dir / "docs").mkdir(parents=True, exist_ok=True)
+    kept: set[Path] = set()
+    written = unchanged = 0
+
+    def save(path: Path, text: str) -> None:
+        nonlocal written, unchanged
+        kept.add(path)
+        if _write_if_changed(path, text):
+            written += 1
+        else:
+            unchanged += 1
+
+    # Шарды пишутся по мере чтения, в памяти только текущий: сообщения идут по rowid,
+    # а слова — в порядке байтов UTF-8, поэтому слова одного шарда идут подряд.
+    chats: list[list[str]] = []
+    chat_index: dict[str, int] = {}
+    messages = 0
+    for number, shard_docs in groupby(store.search_documents(), key=lambda doc: doc["rowid"] // DOCS_PER_SHARD):
+        shard: dict[int, list] = {}
+        for doc in shard_docs:
+            if doc["folder"] not in chat_index:
+                chat_index[doc["folder"]] = len(chats)
+                chats.append([doc["folder"], doc["chat_name"] or doc["folder"]])
+            text = doc["text"]
+            shard[doc["rowid"]] = [
+                chat_index[doc["folder"]], doc["message_id"], doc["page"], doc["sender_name"], doc["date"],
+                doc["timestamp"], 1 if doc["deleted_at"] else 0,
+                text if len(text) <= SNIPPET_LENGTH else text[:SNIPPET_LENGTH] + "…",
+            ]
+        messages += len(shard)
+        save(search_dir / "docs" / f"{number}.js", _script("docs", number, shard))
+
+    terms = 0
+    term_shards = []
+    for key, shard_postings in groupby(store.search_postings(), key=lambda posting: term_shard(posting[0])):
+        shard_terms = {term: [rowid for _, rowid in postings]
+                       for term, postings in groupby(shard_postings, key=lambda posting: posting[0])}
+        terms += len(shard_terms)
+        term_shards.append(key)
+        save(search_dir / "terms" / f"{key}.js", _script("terms", key, shard_terms))
+
+    save(search_dir / "manifest.js", _script("manifest", {
+        "version": SEARCH_EXPORT_VERSION,
+        "docs_per_shard": DOCS_PER_SHARD,
+        "chats": chats,
+        "messages": messages,
+        "term_shards": term_shards,
+    }))
+    save(archive_root / "lists" / SEARCH_PAGE_NAME, SEARCH_PAGE)
+
+    removed = 0
+    for path in [*(search_dir / "terms").glob("*.js"), *(search_dir / "docs").glob("*.js")]:
+        if path not in kept:
+            path.unlink()
+            removed += 1
+    return {"messages": messages, "terms": terms, "written": written, "unchanged": unchanged, "removed": removed}
@@ -0,0 +1,73 @@
+# SenderCache.py
+# LRU/TTL-кэш данных отправителей по sender id.
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+
+@dataclass(frozen=True)
+class SenderInfo:
+    """Данные отправителя, используемые при записи сообщений."""
+    display_name: str
+    sender_name: str
+    initial: str
+
+    @classmethod
+    def from_entity(cls, sender: Any) -> "SenderInfo":
+        """Строит SenderInfo из сущности Telethon (User, Channel)."""
+        first_name = getattr(sender, "first_name", "")
+        last_name = getattr(sender, "last_name", "")
+        username = getattr(sender, "username", "")
+        display_name = f"{first_name} {last_name}".strip() or "Unknown"
+        sender_name = display_name
+        if username:
+            sender_name += f" (@{username})"
+        return cls(display_name, sender_name, display_name[0].upper())
+
+
+class SenderCache:
+    """Класс для кэширования данных отправителей с вытеснением по LRU и сроку жизни."""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 3600.0):
+        """Инициализация кэша.
+
+        Args:
+            max_size (int): Максимальное число отправителей в кэше.
+            ttl (float): Время жизни записи в секундах.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[int, tuple[float, SenderInfo]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sender_id: int) -> Optional[SenderInfo]:
+        """Возвращает данные отправителя или None, если их нет или срок жизни истек."""
+        with self._lock:
+            entry = self._entries.get(sender_id)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self._entries.pop(sender_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(sender_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, sender_id: int, info: SenderInfo) -> None:
+        """Сохраняет данные отправителя, вытесняя самые давно использованные записи."""
+        with self._lock:
+            self._entries[sender_id] = (time.monotonic(), info)
+            self._entries.move_to_end(sender_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, sender_id: int) -> None:
+        """Удаляет данные отправителя, например после смены имени."""
+        with self._lock:
+            self._entries.pop(sender_id, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -2,20 +2,27 @@
 # Класс для управления Telegram-клиентом.
 from telethon import events
 from telethon import TelegramClient
-from typing import Callable
+from telethon.tl.types import UpdateUserName
+from typing import Any, Awaitable, Callable, Optional
+import asyncio
+import inspect
 
 class TelegramClientManager:
     """Класс для управления Telegram клиентом."""
 
-    def __init__(self, apiId: int, apiHash: str, sessionName: str):
+    def __init__(self, apiId: int, apiHash: str, sessionName: str, client: Optional[Any] = None):
         """Инициализация клиента.
 
         Args:
             apiId (int): Telegram API ID.
             apiHash (str): Telegram API Hash.
             sessionName (str): Имя сессии для сохранения авторизации.
+            client (Optional[Any]): Готовый клиент с интерфейсом TelegramClient
+                (например, локальная заглушка для тестов); по умолчанию создается Telethon-клиент.
         """
-        self.client = TelegramClient(sessionName, apiId, apiHash)
+        self.client = client if client is not None else TelegramClient(sessionName, apiId, apiHash)
+        self._periodicTasks: list[tuple[Callable[[], None], float]] = []
+        self._shutdownHooks: list[Callable[[], Optional[Awaitable[None]]]] = []
 
     async def start(self) -> None:
         """Запускает клиент и выполняет авторизацию через терминал."""
@@ -42,10 +49,70 @@ class TelegramClientManager:
         """
         self.client.on(events.MessageEdited)(handler)
 
+    def registerMessageDeletedHandler(self, handler: Callable) -> None:
+        """Регистрирует обработчик удаления сообщений.
+
+        Args:
+            handler (Callable): Функция обработки удаления сообщений.
+        """
+        self.client.on(events.MessageDeleted)(handler)
+
+    def registerUserNameHandler(self, handler: Callable) -> None:
+        """Регистрирует обработчик смены имени или username пользователя.
+
+        Args:
+            handler (Callable): Функция, получающая UpdateUserName.
+        """
+        self.client.on(events.Raw(UpdateUserName))(handler)
+
+    def registerPeriodicTask(self, callback: Callable[[], None], interval: float) -> None:
+        """Регистрирует функцию, вызываемую периодически во время работы клиента.
+
+        Args:
+            callback (Callable[[], None]): Функция без аргументов.
+            interval (float): Интервал вызова в секундах.
+        """
+        self._periodicTasks.append((callback, interval))
+
+    def registerShutdownHook(self, hook: Callable[[], Optional[Awaitable[None]]]) -> None:
+        """Регистрирует функцию, вызываемую при остановке клиента.
+
+        Хуки вызываются в порядке регистрации; корутины дожидаются.
+
+        Args:
+            hook (Callable[[], Optional[Awaitable[None]]]): Функция или корутина без аргументов,
+                например сброс буферов на диск.
+        """
+        self._shutdownHooks.append(hook)
+
+    async def _runPeriodic(self, callback: Callable[[], None], interval: float) -> None:
+        """Вызывает callback каждые interval секунд в отдельном потоке, не блокируя цикл событий."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(callback)
+            except Exception as e:
+                print(f"Ошибка периодической задачи: {e}")
+
+    async def _runShutdownHooks(self) -> None:
+        """Вызывает все зарегистрированные функции остановки."""
+        for hook in self._shutdownHooks:
+            try:
+                result = hook()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"Ошибка при остановке: {e}")
+
     async def run(self) -> None:
         """Запускает клиент в режиме ожидания сообщений."""
+        tasks = [asyncio.create_task(self._runPeriodic(callback, interval)) for callback, interval in self._periodicTasks]
         try:
             await self.client.run_until_disconnected()
         except Exception as e:
             print(f"Ошибка при работе клиента: {e}")
-            raise
\ No newline at end of file
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self._runShutdownHooks()
\ No newline at end of file
@@ -0,0 +1,35 @@
+import asyncio
+from Сonfig import Config
+from TelegramClient import TelegramClientManager
+from MessageHandler import MessageHandler
+from HistoryBackfill import HistoryBackfill
+
+async def main():
+    """Загружает в архивы историю всех диалогов всех аккаунтов, продолжая с сохраненных отметок."""
+    try:
+        config = Config()
+        apiId, apiHash, _ = config.getConfig()
+
+        for account in config.accounts:
+            handler = MessageHandler(config, account)
+            clientManager = TelegramClientManager(apiId, apiHash, account.session_name)
+            await clientManager.start()
+            media = handler.enableMedia(clientManager.client, config) if config.media_enabled else None
+            if media:
+                await media.start()
+
+            backfill = HistoryBackfill(clientManager.client, handler, config.backfill_batch_size)
+            loaded = await backfill.run()
+            if media:
+                # Заодно докачиваем вложения, отложенные трекером при переполнении очереди
+                await media.retry_pending()
+                await media.stop()
+            handler.flush()
+            await clientManager.client.disconnect()
+            print(f"{account.session_name}: загружено сообщений {sum(loaded.values())} из {len(loaded)} диалогов")
+
+    except Exception as e:
+        print(f"Ошибка загрузки истории: {e}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,240 @@
+# benchmark.py
+# Нагрузочный тест пути обработки сообщений на синтетических событиях Telethon.
+#
+# Пример:
+#   python benchmark.py --contacts 200 --messages 50 --edit-ratio 0.1 --output bench.jsonl
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Optional
+
+CHATS_HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+ <head>
+  <meta charset="utf-8"/>
+  <title>Exported Data</title>
+ </head>
+ <body>
+  <div class="page_wrap">
+   <div class="page_body list_page">
+    <div class="entry_list">
+    </div>
+   </div>
+  </div>
+ </body>
+</html>
+"""
+
+
+class FakeSender:
+    """Отправитель с полями Telethon User, которые читает MessageHandler."""
+
+    def __init__(self, sender_id: int):
+        self.id = sender_id
+        self.first_name = f"Contact{sender_id}"
+        self.last_name = "Bench"
+        self.username = f"contact{sender_id}"
+        self.min = False
+
+
+class FakeMessage:
+    """Сообщение с полями Telethon Message, которые читает MessageHandler."""
+
+    def __init__(self, message_id: int, text: str, sender: FakeSender, date: datetime):
+        self.id = message_id
+        self.text = text
+        self.date = date
+        self.edit_date = date
+        self.media = None
+        self.sender = sender
+
+
+class FakeEvent:
+    """Событие NewMessage/MessageEdited с отправителем, пришедшим вместе с обновлением."""
+
+    def __init__(self, message: FakeMessage):
+        self.message = message
+        self.sender = message.sender
+        self.sender_id = message.sender.id
+        self.chat_id = message.sender.id
+
+    async def get_sender(self) -> FakeSender:
+        return self.message.sender
+
+
+def build_workload(contacts: int, messages: int, edit_ratio: float, seed: int) -> list[tuple[str, FakeEvent]]:
+    """Строит воспроизводимую последовательность событий: сообщения вперемешку по чатам и правки."""
+    rng = random.Random(seed)
+    senders = [FakeSender(1000 + i) for i in range(contacts)]
+    date = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    events: list[tuple[str, FakeEvent]] = []
+    sent: dict[int, list[int]] = {sender.id: [] for sender in senders}
+    message_id = 0
+    schedule = [sender for sender in senders for _ in range(messages)]
+    rng.shuffle(schedule)
+    for sender in schedule:
+        message_id += 1
+        date += timedelta(seconds=1)
+        words = " ".join(rng.choice(("hello", "ok", "see you", "<b>", "long message text")) for _ in range(rng.randint(1, 20)))
+        events.append(("new", FakeEvent(FakeMessage(message_id, words, sender, date))))
+        sent[sender.id].append(message_id)
+        if rng.random() < edit_ratio:
+            edited_id = rng.choice(sent[sender.id])
+            events.append(("edit", FakeEvent(FakeMessage(edited_id, f"{words} (edited)", sender, date))))
+    return events
+
+
+def io_write_bytes() -> Optional[int]:
+    """Возвращает число байт, записанных процессом (Linux /proc/self/io), или None."""
+    try:
+        for line in Path("/proc/self/io").read_text().splitlines():
+            if line.startswith("write_bytes:"):
+                return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def tree_bytes(root: Path) -> int:
+    """Возвращает суммарный размер файлов в каталоге."""
+    return sum(path.stat().st_size for path in root.rglob("*") if path.is_file())
+
+
+def git_revision() -> Optional[str]:
+    """Возвращает текущий коммит репозитория, если он доступен."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Возвращает перцентиль по ближайшему рангу."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def replay(handlers: list[Any], events: list[tuple[str, FakeEvent]], use_pipeline: bool, workers: int) -> list[float]:
+    """Проигрывает события через обработчики аккаунтов (чат — всегда в одном аккаунте) и возвращает
+    задержку каждого вызова в секундах.
+
+    С конвейером все аккаунты используют один общий IngestPipeline, как в main.py.
+    """
+    pipeline = None
+    if use_pipeline:
+        from IngestPipeline import IngestPipeline
+        pipeline = IngestPipeline(workers=workers, max_queue=1000)
+        for handler in handlers:
+            handler.usePipeline(pipeline)
+        await pipeline.start()
+    latencies = []
+    for kind, event in events:
+        handler = handlers[event.chat_id % len(handlers)]
+        started = time.perf_counter()
+        if kind == "new":
+            await handler.handleMessage(event)
+        else:
+            await handler.handleMessageEdited(event)
+        latencies.append(time.perf_counter() - started)
+    if pipeline:
+        await pipeline.stop()
+    return latencies
+
+
+def run(args: argparse.Namespace) -> dict:
+    """Готовит временные DataExport (по одному на аккаунт), проигрывает нагрузку и возвращает результаты."""
+    events = build_workload(args.contacts, args.messages, args.edit_ratio, args.seed)
+    with tempfile.TemporaryDirectory(prefix="tracker-bench-") as tmp:
+        root = Path(tmp)
+        sys.path.insert(0, str(Path(__file__).parent))
+        from MessageHandler import MessageHandler
+        from Metrics import metrics
+        from Сonfig import AccountConfig
+
+        config = SimpleNamespace(
+            flush_interval=args.flush_interval, flush_every=args.flush_every, page_size=args.page_size,
+            sender_cache_size=10000, sender_cache_ttl=3600.0, metrics_enabled=args.metrics,
+            journal_enabled=not args.no_journal, journal_sync_window=args.journal_window / 1000,
+        )
+        handlers = []
+        for number in range(args.accounts):
+            export_dir = root / f"DataExport_bench{number}"
+            (export_dir / "lists").mkdir(parents=True)
+            (export_dir / "lists" / "chats.html").write_text(CHATS_HTML_TEMPLATE, encoding="utf-8")
+            handlers.append(MessageHandler(config, AccountConfig(f"bench{number}", str(export_dir))))
+
+        written_before = io_write_bytes()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            latencies = asyncio.run(replay(handlers, events, args.pipeline, args.workers))
+            for handler in handlers:
+                handler.flush()
+        elapsed = time.perf_counter() - started
+        written_after = io_write_bytes()
+
+        return {
+            "label": args.label,
+            "revision": git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "workload": {
+                "contacts": args.contacts, "messages_per_chat": args.messages, "edit_ratio": args.edit_ratio,
+                "seed": args.seed, "events": len(events), "pipeline": args.pipeline, "page_size": args.page_size,
+                "flush_every": args.flush_every, "flush_interval": args.flush_interval,
+                "journal": not args.no_journal, "journal_window_ms": args.journal_window, "accounts": args.accounts,
+            },
+            "results": {
+                "elapsed_seconds": round(elapsed, 4),
+                "events_per_second": round(len(events) / elapsed, 1),
+                "latency_p50_ms": round(statistics.median(latencies) * 1000, 3),
+                "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+                "latency_max_ms": round(max(latencies) * 1000, 3),
+                "bytes_written": written_after - written_before if written_before is not None else None,
+                "archive_bytes": tree_bytes(root),
+            },
+            "metrics": metrics.snapshot() if args.metrics else None,
+        }
+
+
+def main() -> None:
+    """Разбирает аргументы, запускает нагрузку и печатает/сохраняет результат."""
+    parser = argparse.ArgumentParser(description="Нагрузочный тест MessageHandler + ChatHTMLManager")
+    parser.add_argument("--contacts", type=int, default=100, help="число контактов (чатов)")
+    parser.add_argument("--messages", type=int, default=20, help="сообщений на чат")
+    parser.add_argument("--edit-ratio", type=float, default=0.1, help="доля сообщений, за которыми следует правка")
+    parser.add_argument("--seed", type=int, default=1, help="seed генератора нагрузки")
+    parser.add_argument("--page-size", type=int, default=1000, help="сообщений на страницу чата")
+    parser.add_argument("--flush-every", type=int, default=100, help="FLUSH_EVERY")
+    parser.add_argument("--flush-interval", type=float, default=2.0, help="FLUSH_INTERVAL")
+    parser.add_argument("--pipeline", action="store_true", help="обрабатывать через IngestPipeline")
+    parser.add_argument("--workers", type=int, default=4, help="потоков IngestPipeline")
+    parser.add_argument("--accounts", type=int, default=1, help="число аккаунтов (архивов), по которым раздаются события")
+    parser.add_argument("--no-journal", action="store_true", help="без журнала событий (JOURNAL_ENABLED=false)")
+    parser.add_argument("--journal-window", type=float, default=5.0, help="JOURNAL_SYNC_WINDOW_MS")
+    parser.add_argument("--metrics", action="store_true", help="собрать счетчики и время по стадиям (METRICS_ENABLED)")
+    parser.add_argument("--label", default="", help="метка прогона")
+    parser.add_argument("--output", type=Path, help="дописать результат в JSON Lines файл для сравнения между коммитами")
+    args = parser.parse_args()
+    if args.output:
+        args.output = args.output.resolve()
+
+    result = run(args)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with args.output.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
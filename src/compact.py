@@ -0,0 +1,59 @@
+# compact.py
+# Сжатие неактивных чатов архива и восстановление сжатых (запускается при остановленном трекере, как backfill.py).
+#
+# Примеры:
+#   python compact.py --days 180 --dry-run
+#   python compact.py
+#   python compact.py --restore chat_007
+import argparse
+
+from ColdStorage import tree_usage
+from HTMLRenderer import format_size
+from MessageHandler import MessageHandler
+from Сonfig import Config
+
+
+def main() -> None:
+    """Сжимает чаты без активности дольше COLD_AFTER_DAYS дней во всех аккаунтах и печатает отчет."""
+    parser = argparse.ArgumentParser(description="Сжатие неактивных чатов архива")
+    parser.add_argument("--days", type=float, help="дней без активности (по умолчанию COLD_AFTER_DAYS)")
+    parser.add_argument("--dry-run", action="store_true", help="только показать, какие чаты будут сжаты")
+    parser.add_argument("--restore", metavar="FOLDER", nargs="*", help="восстановить сжатые чаты (без имен — все)")
+    args = parser.parse_args()
+
+    try:
+        config = Config()
+        idle_days = args.days if args.days is not None else config.cold_after_days
+        for account in config.accounts:
+            handler = MessageHandler(config, account)
+            handler.flush()
+            manager = handler.chat_manager
+            chats_dir = manager.html_path.parent.parent / "chats"
+
+            if args.restore is not None:
+                folders = args.restore or list(manager.cold.load_index())
+                restored = [folder for folder in folders if manager.cold.rehydrate(chats_dir / folder)]
+                print(f"{account.session_name}: восстановлено чатов {len(restored)}: {', '.join(restored)}")
+                continue
+
+            compacted = manager.compact_cold_chats(handler.event_store, idle_days, args.dry_run)
+            for chat in compacted:
+                after = format_size(chat["compressed_bytes"]) if chat["compressed_bytes"] is not None else "—"
+                print(f"  {chat['folder']}  {chat['name']}  последняя активность {chat['last_activity']}  "
+                      f"файлов {chat['files']}  {format_size(chat['original_bytes'])} -> {after}")
+            original = sum(chat["original_bytes"] for chat in compacted)
+            if args.dry_run:
+                print(f"{account.session_name}: будет сжато чатов {len(compacted)}, занимают {format_size(original)}")
+                continue
+            compressed = sum(chat["compressed_bytes"] for chat in compacted)
+            files = sum(chat["files"] for chat in compacted)
+            cold_files, cold_bytes = tree_usage(manager.cold.cold_dir) if manager.cold.cold_dir.exists() else (0, 0)
+            print(f"{account.session_name}: сжато чатов {len(compacted)}, освобождено {format_size(original - compressed)} "
+                  f"({format_size(original)} -> {format_size(compressed)}), файлов меньше на {files - 2 * len(compacted)}; "
+                  f"всего в {manager.cold.cold_dir.name}/: {cold_files} файлов, {format_size(cold_bytes)}")
+
+    except Exception as e:
+        print(f"Ошибка сжатия: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,113 @@
 import asyncio
+from functools import partial
+from pathlib import Path
 from Сonfig import Config
 from TelegramClient import TelegramClientManager
 from MessageHandler import MessageHandler
+from HistoryBackfill import HistoryBackfill
+from IngestPipeline import IngestPipeline
+from Metrics import metrics
+
+def registerHandlers(clientManager: TelegramClientManager, handler: MessageHandler) -> None:
+    """Регистрирует обработчики событий аккаунта."""
+    # Регистрируем обработчики новых, отредактированных и удаленных сообщений
+    clientManager.registerMessageHandler(handler.handleMessage)
+    clientManager.registerMessageEditedHandler(handler.handleMessageEdited)
+    clientManager.registerMessageDeletedHandler(handler.handleMessageDeleted)
+
+    # Сбрасываем кэш отправителя при смене имени
+    clientManager.registerUserNameHandler(handler.handleUserNameUpdate)
 
 async def main():
-    """Основная функция для запуска приложения."""
+    """Основная функция для запуска приложения: все аккаунты из SESSIONS в одном процессе."""
+    pipeline = None
+    handlers: list[MessageHandler] = []
+    server = None
+    writeStats = None
     try:
         # Загружаем конфигурацию
         config = Config()
-        apiId, apiHash, sessionName = config.getConfig()
+        apiId, apiHash, _ = config.getConfig()
+
+        # Обработка событий в общем для всех аккаунтов пуле потоков; при остановке сначала дорабатываем очередь
+        pipeline = IngestPipeline(workers=config.ingest_workers, max_queue=config.ingest_queue_size)
+
+        clients: list[tuple[TelegramClientManager, MessageHandler]] = []
+        for account in config.accounts:
+            # Архив аккаунта: пакетная запись событий и chats.html, размер страниц чатов
+            handler = MessageHandler(config, account)
+            handler.usePipeline(pipeline)
+            handlers.append(handler)
+
+            # Инициализируем клиент
+            clientManager = TelegramClientManager(apiId, apiHash, account.session_name)
 
-        # Инициализируем клиент
-        clientManager = TelegramClientManager(apiId, apiHash, sessionName)
+            # Периодический сброс архива аккаунта
+            clientManager.registerPeriodicTask(handler.flushIfDue, config.flush_interval)
 
-        # Регистрируем обработчик новых сообщений
-        clientManager.registerMessageHandler(MessageHandler.handleMessage)
+            # Скачивание вложений отдельно от текста; записи о них идут в тот же конвейер
+            media = handler.enableMedia(clientManager.client, config) if config.media_enabled else None
+            if media:
+                clientManager.registerShutdownHook(media.stop)
+            clients.append((clientManager, handler))
 
-        # Регистрируем обработчик редактирования сообщений
-        clientManager.registerMessageEditedHandler(MessageHandler.handleMessageEdited)
+        # Метрики по стадиям: один эндпоинт /metrics и/или периодически перезаписываемый файл на процесс
+        if config.metrics_enabled:
+            metrics.add_source(pipeline.metrics)
+            for handler in handlers:
+                handler.enableMetrics()
+            if config.metrics_port:
+                server = metrics.serve(config.metrics_port)
+            if config.metrics_file:
+                writeStats = partial(metrics.write_stats_file, Path(config.metrics_file))
+                clients[0][0].registerPeriodicTask(writeStats, config.metrics_interval)
 
-        # Запускаем клиент
-        await clientManager.start()
-        await clientManager.run()
+        # Запускаем клиенты
+        await pipeline.start()
+        for clientManager, handler in clients:
+            if handler.media_downloader:
+                await handler.media_downloader.start()
+            await clientManager.start()
+
+        # Догоняем сообщения, пропущенные пока трекер не работал, до регистрации обработчиков:
+        # иначе пропущенные сообщения дописались бы в чаты после более новых
+        if config.backfill_on_start:
+            for clientManager, handler in clients:
+                await HistoryBackfill(clientManager.client, handler, config.backfill_batch_size).run()
+
+        for clientManager, handler in clients:
+            registerHandlers(clientManager, handler)
+            # Докачиваем вложения, отложенные при переполнении очереди в прошлый раз
+            if handler.media_downloader:
+                handler.media_downloader.start_retry()
+
+        # Второй, короткий проход забирает сообщения, пришедшие во время первого
+        if config.backfill_on_start:
+            for clientManager, handler in clients:
+                await HistoryBackfill(clientManager.client, handler, config.backfill_batch_size).run()
+
+        # Ошибка одного клиента не останавливает остальные
+        results = await asyncio.gather(*(clientManager.run() for clientManager, _ in clients), return_exceptions=True)
+        for (_, handler), result in zip(clients, results):
+            if isinstance(result, Exception):
+                print(f"Ошибка клиента {handler.name}: {result}")
 
     except Exception as e:
         print(f"Ошибка приложения: {e}")
 
+    finally:
+        # Общие для всех аккаунтов ресурсы останавливаются после отключения всех клиентов
+        if pipeline is not None:
+            await pipeline.stop()
+        for handler in handlers:
+            try:
+                handler.flush()
+            except Exception as e:
+                print(f"Ошибка при остановке {handler.name}: {e}")
+        if server:
+            server.shutdown()
+        if writeStats:
+            writeStats()
+
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+# search.py
+# Поиск по архиву из командной строки и выгрузка статического индекса для lists/search.html.
+#
+# Примеры:
+#   python search.py "привет мир" --chat Иван --since 2025-01-01
+#   python search.py --export
+import argparse
+from datetime import date, timedelta
+from typing import Optional
+
+from EventStore import EventStore
+from MessageHandler import find_chats_html
+from SearchIndex import export_search_index, fts_query, message_href
+from Сonfig import Config
+
+
+def next_day(value: Optional[str]) -> Optional[str]:
+    """Возвращает дату ISO следующего дня, чтобы --until включал сам указанный день."""
+    return (date.fromisoformat(value) + timedelta(days=1)).isoformat() if value else None
+
+
+def account_export_dir(name: Optional[str]) -> Optional[str]:
+    """Возвращает каталог экспорта аккаунта из configuration.env (по умолчанию первого)."""
+    accounts = Config().accounts
+    if name is None:
+        return accounts[0].export_dir
+    for account in accounts:
+        if account.session_name == name:
+            return account.export_dir
+    raise ValueError(f"Аккаунт {name} не найден в SESSIONS")
+
+
+def main() -> None:
+    """Разбирает аргументы, ищет сообщения или выгружает статический индекс."""
+    parser = argparse.ArgumentParser(description="Поиск по архиву сообщений")
+    parser.add_argument("query", nargs="?", help="слова для поиска; последнее ищется по началу слова")
+    parser.add_argument("--chat", help="peer id чата или часть его имени")
+    parser.add_argument("--sender", help="часть имени отправителя")
+    parser.add_argument("--since", help="с даты (YYYY-MM-DD, UTC)")
+    parser.add_argument("--until", help="по дату включительно (YYYY-MM-DD, UTC)")
+    parser.add_argument("--limit", type=int, default=20, help="максимум результатов")
+    parser.add_argument("--export", action="store_true", help="выгрузить индекс в search/ для lists/search.html")
+    parser.add_argument("--export-dir", help="каталог экспорта (по умолчанию EXPORT_DIR из configuration.env)")
+    parser.add_argument("--account", help="имя сессии из SESSIONS, в архиве которой искать (по умолчанию первая)")
+    args = parser.parse_args()
+    if not args.query and not args.export:
+        parser.error("нужен запрос или --export")
+
+    try:
+        html_path = find_chats_html(args.export_dir or account_export_dir(args.account))
+        archive_root = html_path.parent.parent
+        store = EventStore(archive_root / "archive.sqlite")
+
+        if args.export:
+            stats = export_search_index(store, archive_root)
+            print(f"Индекс выгружен: сообщений {stats['messages']}, слов {stats['terms']}, "
+                  f"файлов записано {stats['written']}, без изменений {stats['unchanged']}, удалено {stats['removed']}")
+            print(f"Страница поиска: {html_path.parent / 'search.html'}")
+
+        if args.query:
+            since = date.fromisoformat(args.since).isoformat() if args.since else None
+            results = store.search(fts_query(args.query), args.chat, args.sender, since, next_day(args.until), args.limit)
+            for result in results:
+                deleted = " (удалено)" if result["deleted_at"] else ""
+                print(f"{result['timestamp']}  {result['chat_name'] or result['peer_id']}  {result['sender_name']}{deleted}")
+                print(f"    {result['snippet']}")
+                if result["folder"]:
+                    print(f"    {archive_root / message_href(result['folder'], result['page'], result['message_id'])}")
+            print(f"Найдено: {len(results)}")
+        store.close()
+
+    except Exception as e:
+        print(f"Ошибка поиска: {e}")
+
+if __name__ == "__main__":
+    main()
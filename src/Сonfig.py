@@ -1,11 +1,19 @@
 # Config.py
 # Чтение конфигурации из .env
 
+from dataclasses import dataclass
 from typing import Optional
 from dotenv import load_dotenv
 import os
 
 
+@dataclass
+class AccountConfig:
+    """Аккаунт: имя сессии Telethon и каталог его экспорта (архива)."""
+    session_name: str
+    export_dir: Optional[str] = None
+
+
 class Config:
     """Класс для загрузки и валидации конфигурации из .env файла."""
 
@@ -19,6 +27,28 @@ class Config:
         self.api_id: Optional[int] = None
         self.api_hash: Optional[str] = None
         self.session_name: Optional[str] = None
+        self.export_dir: Optional[str] = None
+        self.accounts: list[AccountConfig] = []
+        self.flush_interval: float = 2.0
+        self.flush_every: int = 100
+        self.ingest_workers: int = 4
+        self.ingest_queue_size: int = 1000
+        self.page_size: int = 1000
+        self.sender_cache_size: int = 10000
+        self.sender_cache_ttl: float = 3600.0
+        self.backfill_batch_size: int = 500
+        self.backfill_on_start: bool = False
+        self.media_enabled: bool = True
+        self.media_workers: int = 4
+        self.media_chat_budget: int = 0
+        self.media_global_budget: int = 0
+        self.cold_after_days: float = 90.0
+        self.journal_enabled: bool = True
+        self.journal_sync_window: float = 0.005
+        self.metrics_enabled: bool = False
+        self.metrics_port: int = 0
+        self.metrics_file: Optional[str] = None
+        self.metrics_interval: float = 15.0
         self._load_config()
 
     def _load_config(self) -> None:
@@ -26,12 +56,63 @@ class Config:
         self.api_id = os.getenv("API_ID")
         self.api_hash = os.getenv("API_HASH")
         self.session_name = os.getenv("SESSION_NAME") or "default_session"
+        self.export_dir = os.getenv("EXPORT_DIR") or None
 
         if not self.api_id:
             raise RuntimeError("❌ Не найден API_ID в configuration.env")
         if not self.api_hash:
             raise RuntimeError("❌ Не найден API_HASH в configuration.env")
 
+        try:
+            self.flush_interval = float(os.getenv("FLUSH_INTERVAL") or self.flush_interval)
+            self.flush_every = int(os.getenv("FLUSH_EVERY") or self.flush_every)
+            self.ingest_workers = int(os.getenv("INGEST_WORKERS") or self.ingest_workers)
+            self.ingest_queue_size = int(os.getenv("INGEST_QUEUE_SIZE") or self.ingest_queue_size)
+            self.page_size = int(os.getenv("PAGE_SIZE") or self.page_size)
+            self.sender_cache_size = int(os.getenv("SENDER_CACHE_SIZE") or self.sender_cache_size)
+            self.sender_cache_ttl = float(os.getenv("SENDER_CACHE_TTL") or self.sender_cache_ttl)
+            self.backfill_batch_size = int(os.getenv("BACKFILL_BATCH_SIZE") or self.backfill_batch_size)
+            self.media_workers = int(os.getenv("MEDIA_WORKERS") or self.media_workers)
+            self.media_chat_budget = int(float(os.getenv("MEDIA_CHAT_BUDGET_MB") or 0) * 1024 * 1024)
+            self.media_global_budget = int(float(os.getenv("MEDIA_GLOBAL_BUDGET_MB") or 0) * 1024 * 1024)
+            self.cold_after_days = float(os.getenv("COLD_AFTER_DAYS") or self.cold_after_days)
+            self.journal_sync_window = float(os.getenv("JOURNAL_SYNC_WINDOW_MS") or self.journal_sync_window * 1000) / 1000
+            self.metrics_port = int(os.getenv("METRICS_PORT") or self.metrics_port)
+            self.metrics_interval = float(os.getenv("METRICS_INTERVAL") or self.metrics_interval)
+        except ValueError:
+            raise RuntimeError("❌ Числовые параметры configuration.env (FLUSH_*, INGEST_*, PAGE_SIZE, SENDER_CACHE_*, BACKFILL_BATCH_SIZE, MEDIA_*, COLD_AFTER_DAYS, JOURNAL_SYNC_WINDOW_MS, METRICS_PORT, METRICS_INTERVAL) должны быть числами")
+        self.backfill_on_start = (os.getenv("BACKFILL_ON_START") or "").lower() in ("1", "true", "yes")
+        self.media_enabled = (os.getenv("MEDIA_ENABLED") or "true").lower() in ("1", "true", "yes")
+        self.journal_enabled = (os.getenv("JOURNAL_ENABLED") or "true").lower() in ("1", "true", "yes")
+        self.metrics_enabled = (os.getenv("METRICS_ENABLED") or "").lower() in ("1", "true", "yes")
+        self.metrics_file = os.getenv("METRICS_FILE") or None
+        if self.page_size < 1:
+            raise RuntimeError("❌ PAGE_SIZE должен быть больше нуля")
+        self.accounts = self._load_accounts(os.getenv("SESSIONS") or "")
+
+    def _load_accounts(self, sessions: str) -> list[AccountConfig]:
+        """Разбирает SESSIONS вида "имя=каталог_экспорта,имя2=каталог2".
+
+        Без SESSIONS используется один аккаунт из SESSION_NAME и EXPORT_DIR. Если
+        аккаунтов несколько, у каждого должен быть свой каталог экспорта.
+        """
+        if not sessions.strip():
+            return [AccountConfig(self.session_name, self.export_dir)]
+        accounts = []
+        for item in sessions.split(","):
+            name, _, export_dir = item.strip().partition("=")
+            if not name.strip():
+                raise RuntimeError(f"❌ Пустое имя сессии в SESSIONS: {item!r}")
+            accounts.append(AccountConfig(name.strip(), export_dir.strip() or None))
+        if len(accounts) > 1:
+            if any(account.export_dir is None for account in accounts):
+                raise RuntimeError("❌ В SESSIONS у каждого аккаунта должен быть свой каталог экспорта: имя=каталог")
+            if len({os.path.realpath(account.export_dir) for account in accounts}) < len(accounts):
+                raise RuntimeError("❌ Каталоги экспорта аккаунтов в SESSIONS должны различаться")
+        if len({account.session_name for account in accounts}) < len(accounts):
+            raise RuntimeError("❌ Имена сессий в SESSIONS должны различаться")
+        return accounts
+
     def getConfig(self) -> tuple[int, str, str]:
         """Возвращает конфигурационные данные.
 